@@ -12,6 +12,16 @@ from elasticsearch import Elasticsearch
 from redis import Redis
 import rq
 from config import Config
+from app.cache import LRUCache
+from app.language import LanguageDetector
+from app.metrics import Metrics, RedisMetrics
+from app.outbox import LocalOutboxQueue, Outbox, RedisOutboxQueue
+from app.passwords import PasswordHasher
+from app.progress import LocalTaskProgress, RedisTaskProgress
+from app.pubsub import LocalBroker, RedisBroker
+from app.translate import LocalTranslationCache, RedisTranslationCache, \
+    cached_translations
+from app.watermarks import LocalWatermarks, RedisWatermarks
 
 
 def get_locale():
@@ -38,10 +48,51 @@ def create_app(config_class=Config):
     mail.init_app(app)
     moment.init_app(app)
     babel.init_app(app, locale_selector=get_locale)
+    app.redis = Redis.from_url(app.config['REDIS_URL'])
+    app.metrics = Metrics(shared=RedisMetrics(app.redis)
+                          if app.config['REDIS_URL'] else None)
+    app.passwords = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue_size=app.config['PASSWORD_HASH_QUEUE_SIZE'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'])
     app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
         if app.config['ELASTICSEARCH_URL'] else None
-    app.redis = Redis.from_url(app.config['REDIS_URL'])
+    from app.search import IndexingQueue
+    app.search_queue = IndexingQueue(
+        app, batch_size=app.config['SEARCH_BATCH_SIZE'],
+        flush_interval=app.config['SEARCH_FLUSH_INTERVAL'],
+        rebuild_check_interval=app.config['SEARCH_REBUILD_CHECK_INTERVAL'])
     app.task_queue = rq.Queue('microblog-tasks', connection=app.redis)
+    app.broker = RedisBroker(app.redis) if app.config['REDIS_URL'] \
+        else LocalBroker()
+    app.notification_marks = RedisWatermarks(app.redis) \
+        if app.config['REDIS_URL'] else LocalWatermarks()
+    app.task_progress = RedisTaskProgress(app.redis) \
+        if app.config['REDIS_URL'] else LocalTaskProgress()
+    app.outbox = Outbox(
+        app, mail, RedisOutboxQueue(app.redis) if app.config['REDIS_URL']
+        else LocalOutboxQueue(), workers=app.config['MAIL_OUTBOX_WORKERS'],
+        max_retries=app.config['MAIL_OUTBOX_MAX_RETRIES'])
+    app.language = LanguageDetector(
+        cache_size=app.config['LANGUAGE_CACHE_SIZE'])
+    app.language.preload()
+    app.translation_cache = RedisTranslationCache(
+        app.redis, ttl=app.config['TRANSLATION_CACHE_TTL']) \
+        if app.config['REDIS_URL'] else LocalTranslationCache(
+            maxsize=app.config['TRANSLATION_CACHE_SIZE'],
+            ttl=app.config['TRANSLATION_CACHE_TTL'])
+    app.jinja_env.globals['cached_translations'] = cached_translations
+    app.user_cache = LRUCache(
+        maxsize=app.config['USER_CACHE_SIZE'],
+        ttl=app.config['USER_CACHE_TTL'], broker=app.broker,
+        channel='user-cache')
+
+    from app.models import User
+    from app.presence import LastSeenBuffer
+    app.last_seen = LastSeenBuffer(
+        User, granularity=app.config['LAST_SEEN_GRANULARITY'],
+        flush_interval=app.config['LAST_SEEN_FLUSH_INTERVAL'])
 
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
@@ -16,4 +16,7 @@ def bad_request(message):
 
 @bp.errorhandler(HTTPException)
 def handle_exception(e):
-    return error_response(e.code)
+    # Keep headers such as Retry-After and Allow that describe the error
+    headers = [(name, value) for name, value in e.get_headers()
+               if name != 'Content-Type']
+    return *error_response(e.code), headers
@@ -0,0 +1,9 @@
+from flask import current_app
+from app.api import bp
+from app.api.auth import token_auth
+
+
+@bp.route('/metrics', methods=['GET'])
+@token_auth.login_required
+def get_metrics():
+    return current_app.metrics.snapshot()
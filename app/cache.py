@@ -0,0 +1,108 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+import redis
+from flask import current_app, g, has_request_context
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=60, broker=None, channel=None,
+                 max_messages=100, resubscribe=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.broker = broker
+        self.channel = channel
+        self.max_messages = max_messages
+        self.resubscribe = resubscribe
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._subscription = None
+        self._subscription_lock = threading.Lock()
+        self._subscribe_after = 0
+
+    def get(self, key):
+        self._receive()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        self.discard(keys)
+        if self.broker is not None:
+            self.broker.publish(self.channel, json.dumps(keys))
+
+    def _receive(self):
+        # Invalidations published by other workers are drained without
+        # blocking before every lookup, so no listener thread is needed
+        if self.broker is None:
+            return
+        with self._subscription_lock:
+            if self._subscription is None:
+                if time.monotonic() < self._subscribe_after:
+                    return
+                try:
+                    self._subscription = self.broker.subscribe(self.channel)
+                except redis.exceptions.RedisError:
+                    # Without a subscription entries are only bounded by
+                    # their TTL until a later lookup manages to subscribe
+                    current_app.logger.warning(
+                        'Could not subscribe to %s', self.channel,
+                        exc_info=True)
+                    self._subscribe_after = \
+                        time.monotonic() + self.resubscribe
+                return
+            for _ in range(self.max_messages):
+                message = self._subscription.get(timeout=0)
+                if message is None:
+                    break
+                try:
+                    keys = json.loads(message)
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(keys, list):
+                    # JSON turns tuple keys into lists
+                    self.discard(tuple(key) if isinstance(key, list) else key
+                                 for key in keys)
+
+
+def request_cached(method):
+    # Values derived for a user are computed once per request, however many
+    # templates and views ask for them
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if not has_request_context():
+            return method(self, *args)
+        cache = g.setdefault('request_cache', {})
+        key = (method.__qualname__, self.id, args)
+        if key not in cache:
+            cache[key] = method(self, *args)
+        return cache[key]
+    return wrapper
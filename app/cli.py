@@ -1,6 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
-from flask import Blueprint
+import time
+from flask import Blueprint, current_app
 import click
+import sqlalchemy as sa
+from app import db
+from app.exports import sweep_exports
+from app.language import LanguageDetector, backfill_languages, load_profiles
+from app.models import User, Post, Timeline, Notification
+from app.passwords import PasswordHasher
+from app.search import ElasticsearchBackend, FTS5Backend
+from app.translate import prefetch_translations
 
 bp = Blueprint('cli', __name__, cli_group=None)
 
@@ -38,3 +48,210 @@ def compile():
     """Compile all languages."""
     if os.system('pybabel compile -d app/translations'):
         raise RuntimeError('compile command failed')
+
+
+@translate.command()
+@click.option('--enqueue', is_flag=True,
+              help='Run on the task queue instead of in this process.')
+def prefetch(enqueue):
+    """Pre-translate recent popular posts into the translation cache."""
+    if enqueue:
+        job = current_app.task_queue.enqueue('app.tasks.pretranslate_posts')
+        click.echo(f'Queued job {job.get_id()}')
+        return
+    stats = prefetch_translations()
+    click.echo('{translations} translations in {seconds:.2f}s '
+               '({per_second:.1f}/s)'.format(**stats))
+
+
+@bp.cli.group()
+def timeline():
+    """Home timeline maintenance commands."""
+    pass
+
+
+@timeline.command()
+def rebuild():
+    """Rebuild all home timelines from posts and followers."""
+    Timeline.rebuild()
+    db.session.commit()
+
+
+@bp.cli.group()
+def counters():
+    """Denormalized counter commands."""
+    pass
+
+
+@counters.command()
+def reconcile():
+    """Recompute all user post, follower and unread message counters."""
+    User.reconcile_counters()
+    db.session.commit()
+
+
+@bp.cli.group()
+def notifications():
+    """Notification maintenance commands."""
+    pass
+
+
+@notifications.command('sweep')
+@click.option('--max-age', type=int, help='Seconds to keep notifications '
+              'for (default: NOTIFICATIONS_TTL).')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Notifications deleted per transaction.')
+def notifications_sweep(max_age, batch_size):
+    """Delete notifications older than their time to live."""
+    removed = Notification.sweep(
+        max_age or current_app.config['NOTIFICATIONS_TTL'], batch_size)
+    click.echo('Removed {} notifications'.format(removed))
+
+
+@bp.cli.group()
+def exports():
+    """Post export commands."""
+    pass
+
+
+@exports.command()
+@click.option('--max-age', type=int,
+              help='Seconds to keep exports for (default: EXPORT_RETENTION).')
+def sweep(max_age):
+    """Delete exports older than the retention period."""
+    removed = sweep_exports(current_app.config['EXPORT_DIR'],
+                            max_age or current_app.config['EXPORT_RETENTION'])
+    click.echo('Removed {} exports'.format(removed))
+
+
+@bp.cli.group()
+def search():
+    """Full-text search index commands."""
+    pass
+
+
+@search.command()
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Rows read and sent per bulk request.')
+@click.option('--workers', default=4, show_default=True,
+              help='Bulk requests sent in parallel.')
+@click.option('--index', help='Resume building into this index.')
+@click.option('--start-after', default=0,
+              help='Resume after this id (Elasticsearch also needs --index).')
+def reindex(chunk_size, workers, index, start_after):
+    """Rebuild the post index and swap it in without downtime."""
+    def progress(index, last_id, count):
+        click.echo(f'{index}: {count} documents, last id {last_id}')
+
+    try:
+        index = Post.reindex(chunk_size=chunk_size, workers=workers,
+                             index=index, start_after=start_after,
+                             progress=progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if index is None:
+        raise click.ClickException('No search backend is configured')
+    db.session.commit()
+    click.echo(f'post is now served by {index}')
+
+
+@search.command()
+@click.option('--runs', default=100, show_default=True,
+              help='Times each query is repeated.')
+@click.argument('queries', nargs=-1, required=True)
+def benchmark(runs, queries):
+    """Compare post query latency of the available search backends."""
+    backends = {}
+    if db.engine.dialect.name == 'sqlite':
+        backends['fts5'] = FTS5Backend(db.session.connection())
+    if current_app.elasticsearch:
+        backends['elasticsearch'] = ElasticsearchBackend(
+            current_app.elasticsearch)
+    if not backends:
+        raise click.ClickException('No search backend is available')
+    per_page = current_app.config['POSTS_PER_PAGE']
+    for name, backend in backends.items():
+        for query in queries:
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                _, total = backend.query('post', query, 1, per_page)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            click.echo('{:<14} {!r:<20} {:>6} hits  mean {:.2f} ms  '
+                       'p95 {:.2f} ms'.format(
+                           name, query, total, sum(timings) / runs,
+                           timings[min(runs - 1, int(runs * 0.95))]))
+
+
+@bp.cli.group()
+def passwords():
+    """Password hashing commands."""
+    pass
+
+
+@passwords.command('benchmark')
+@click.option('--logins', default=50, show_default=True,
+              help='Password checks to run.')
+@click.option('--method', help='Hash method to measure instead of the '
+              'configured one, e.g. pbkdf2:sha256:600000.')
+def password_benchmark(logins, method):
+    """Measure password checks per second on the hashing pool."""
+    hasher = current_app.passwords
+    if method:
+        hasher = PasswordHasher(method, workers=hasher.workers,
+                                queue_size=logins)
+    password_hash = hasher.hash('benchmark password')
+    with ThreadPoolExecutor(max_workers=hasher.workers * 2) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(
+            lambda _: hasher.verify(password_hash, 'benchmark password'),
+            range(logins)))
+        elapsed = time.perf_counter() - start
+    if not all(results):
+        raise click.ClickException('Password verification failed')
+    rate = logins / elapsed
+    cores = min(hasher.workers, os.cpu_count() or 1)
+    click.echo(f'{hasher.method}: {rate:.1f} logins/sec with '
+               f'{hasher.workers} workers, {rate / cores:.1f} per core')
+
+
+@bp.cli.group()
+def language():
+    """Post language detection commands."""
+    pass
+
+
+@language.command()
+def backfill():
+    """Detect the language of posts that were saved without one."""
+    click.echo(f'Detected the language of {backfill_languages()} posts')
+
+
+@language.command('benchmark')
+@click.option('--corpus', type=click.File(encoding='utf-8'),
+              help='File with one sample post per line. Defaults to the '
+              'most recent posts.')
+@click.option('--limit', default=1000, show_default=True,
+              help='Posts read from the database.')
+def language_benchmark(corpus, limit):
+    """Measure language detection throughput."""
+    if corpus:
+        texts = [line.strip() for line in corpus if line.strip()]
+    else:
+        texts = db.session.scalars(sa.select(Post.body).order_by(
+            Post.id.desc()).limit(limit)).all()
+    if not texts:
+        raise click.ClickException('No sample posts to detect')
+    load_profiles()
+    detector = LanguageDetector(cache_size=len(texts))
+    quick = sum(1 for text in texts if detector.quick(text))
+    click.echo(f'{len(texts)} posts, {quick} decided by the quick check')
+    for name, detect in (('langdetect', detector._langdetect),
+                         ('service (cold)', detector.detect),
+                         ('service (memoized)', detector.detect)):
+        start = time.perf_counter()
+        for text in texts:
+            detect(text)
+        elapsed = time.perf_counter() - start
+        click.echo(f'{name:<20} {len(texts) / elapsed:>10.1f} posts/sec')
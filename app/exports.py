@@ -0,0 +1,101 @@
+import gzip
+import json
+import os
+import time
+import sqlalchemy as sa
+from app import db
+from app.models import Post
+
+EXPORT_CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class ProgressThrottle:
+    def __init__(self, callback, rate=1.0):
+        self.callback = callback
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._last = None
+
+    def __call__(self, progress):
+        now = time.monotonic()
+        if self._last is None or now - self._last >= self.interval:
+            self._last = now
+            self.callback(progress)
+
+
+def post_chunks(user, chunk_size=1000):
+    # Keyset pagination keeps every chunk an index range scan, however deep
+    # into the user's history the export is
+    query = sa.select(Post.id, Post.body, Post.timestamp).where(
+        Post.user_id == user.id).order_by(Post.timestamp, Post.id)
+    last = None
+    while True:
+        chunk_query = query
+        if last is not None:
+            chunk_query = query.where(sa.or_(
+                Post.timestamp > last.timestamp,
+                sa.and_(Post.timestamp == last.timestamp,
+                        Post.id > last.id)))
+        rows = db.session.execute(chunk_query.limit(chunk_size)).all()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+
+
+def export_filename(name, format='json', compress=False):
+    return '{}.{}{}'.format(name, format, '.gz' if compress else '')
+
+
+def export_content_type(format='json', compress=False):
+    return 'application/gzip' if compress else EXPORT_CONTENT_TYPES[format]
+
+
+def write_export(path, chunks, format='json', compress=False, total=None,
+                 progress=None):
+    # The file is written under a temporary name and renamed at the end, so
+    # a half written export is never served
+    partial = path + '.part'
+    opener = gzip.open if compress else open
+    separator = '\n' if format == 'ndjson' else ',\n'
+    count = 0
+    with opener(partial, 'wt', encoding='utf-8') as f:
+        if format == 'json':
+            f.write('{"posts": [\n')
+        for rows in chunks:
+            for row in rows:
+                if count and format == 'json':
+                    f.write(separator)
+                f.write(json.dumps({
+                    'body': row.body,
+                    'timestamp': row.timestamp.isoformat() + 'Z'}))
+                if format == 'ndjson':
+                    f.write(separator)
+                count += 1
+            if progress is not None and total:
+                progress(100 * count // total)
+        if format == 'json':
+            f.write('\n]}\n')
+    os.replace(partial, path)
+    return count
+
+
+def sweep_exports(directory, max_age):
+    # Leftover .part files from crashed exports are swept along with
+    # expired exports
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
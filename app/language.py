@@ -0,0 +1,134 @@
+from collections import Counter
+import re
+import threading
+import unicodedata
+import sqlalchemy as sa
+from flask import current_app
+from langdetect import DetectorFactory, LangDetectException
+from langdetect.detector_factory import PROFILES_DIRECTORY
+from app.cache import LRUCache
+
+SCRIPTS = {
+    'HANGUL': 'ko', 'THAI': 'th', 'GREEK': 'el', 'HEBREW': 'he',
+    'BENGALI': 'bn', 'TAMIL': 'ta', 'TELUGU': 'te', 'GUJARATI': 'gu',
+    'KANNADA': 'kn', 'MALAYALAM': 'ml', 'GURMUKHI': 'pa',
+}
+
+STOP_WORDS = {
+    'en': 'the and is are was of to in that it for with you this have not '
+          'on my at be',
+    'es': 'el la los las que y es en un una por con para del muy pero '
+          'está mi se lo',
+    'fr': 'le la les et est un une des du que pas pour dans avec je il ce '
+          'sur sont mais',
+    'de': 'der die das und ist nicht ein eine ich zu mit auf den von sich '
+          'es dem auch für sind',
+    'it': 'il lo gli la che e è di un una per non sono con del della mi ma '
+          'questo anche',
+    'pt': 'o os as que e é um uma não para com do da em no na mas eu por '
+          'muito',
+    'nl': 'de het een en van is niet dat ik je op te zijn met voor maar ook '
+          'er dit wat',
+}
+
+WORDS = re.compile(r'\w+')
+
+_stop_word_languages = {}
+for _language, _words in STOP_WORDS.items():
+    for _word in _words.split():
+        _stop_word_languages.setdefault(_word, []).append(_language)
+
+_factory = None
+_factory_lock = threading.Lock()
+
+
+def load_profiles():
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            factory = DetectorFactory()
+            factory.load_profile(PROFILES_DIRECTORY)
+            # A fixed seed makes langdetect return the same answer for the
+            # same text
+            factory.set_seed(0)
+            _factory = factory
+    return _factory
+
+
+def script_language(text):
+    scripts = Counter()
+    letters = 0
+    for char in text:
+        if char.isalpha():
+            letters += 1
+            scripts[unicodedata.name(char, '').split(' ', 1)[0]] += 1
+    if not letters:
+        return None
+    kana = scripts['HIRAGANA'] + scripts['KATAKANA']
+    if kana and (kana + scripts['CJK']) * 2 > letters:
+        return 'ja'
+    script, count = scripts.most_common(1)[0]
+    if count * 2 > letters and script in SCRIPTS:
+        return SCRIPTS[script]
+    return None
+
+
+def stop_word_language(text, min_hits=3):
+    hits = Counter()
+    for word in WORDS.findall(text.lower()):
+        hits.update(_stop_word_languages.get(word, ()))
+    if not hits:
+        return None
+    ranked = hits.most_common(2)
+    language, count = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    if count >= min_hits and count > 2 * runner_up:
+        return language
+    return None
+
+
+class LanguageDetector:
+    def __init__(self, cache_size=4096):
+        self._cache = LRUCache(maxsize=cache_size, ttl=float('inf'))
+
+    def preload(self):
+        load_profiles()
+
+    def quick(self, text):
+        return script_language(text) or stop_word_language(text)
+
+    def detect(self, text):
+        language = self._cache.get(text)
+        if language is None:
+            language = self.quick(text) or self._langdetect(text)
+            self._cache.put(text, language)
+        return language
+
+    def _langdetect(self, text):
+        detector = load_profiles().create()
+        detector.append(text)
+        try:
+            return detector.detect()
+        except LangDetectException:
+            return ''
+
+
+def backfill_languages(batch_size=500, ids=None):
+    from app import db
+    from app.models import Post
+    query = sa.select(Post.id, Post.body).where(Post.language.is_(None))
+    if ids is not None:
+        # Jobs for single posts go by primary key instead of scanning for
+        # every post without a language
+        query = query.where(Post.id.in_(ids))
+    count = 0
+    while True:
+        rows = db.session.execute(
+            query.order_by(Post.id).limit(batch_size)).all()
+        if not rows:
+            return count
+        db.session.execute(sa.update(Post), [
+            {'id': id, 'language': current_app.language.detect(body)}
+            for id, body in rows])
+        db.session.commit()
+        count += len(rows)
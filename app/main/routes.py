@@ -1,23 +1,27 @@
 from datetime import datetime, timezone
+import json
+import time
 from flask import render_template, flash, redirect, url_for, request, g, \
-    current_app
+    current_app, Response, abort, send_from_directory
 from flask_login import current_user, login_required
 from flask_babel import _, get_locale
 import sqlalchemy as sa
-from langdetect import detect, LangDetectException
 from app import db
 from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm, \
     MessageForm
-from app.models import User, Post, Message, Notification
-from app.translate import translate
+from app.models import User, Post, Message, Notification, Task
+from app.pagination import KeysetPagination, decode_cursor, paginate
+from app.translate import MAX_BATCH_SIZE, translate, translate_many
 from app.main import bp
 
 
 @bp.before_app_request
 def before_request():
+    # g outlives the request when an app context is already pushed, as in
+    # tests and CLI commands
+    g.request_cache = {}
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        current_app.last_seen.touch(current_user)
         g.search_form = SearchForm()
     g.locale = str(get_locale())
 
@@ -28,23 +32,29 @@ def before_request():
 def index():
     form = PostForm()
     if form.validate_on_submit():
-        try:
-            language = detect(form.post.data)
-        except LangDetectException:
-            language = ''
+        if current_app.config['LANGUAGE_DETECTION_DEFERRED']:
+            # Leave posts the quick check cannot classify to the backfill
+            language = current_app.language.quick(form.post.data)
+        else:
+            language = current_app.language.detect(form.post.data)
         post = Post(body=form.post.data, author=current_user,
                     language=language)
         db.session.add(post)
         db.session.commit()
+        if language is None:
+            current_app.task_queue.enqueue('app.tasks.detect_post_languages',
+                                           post.id)
         flash(_('Your post is now live!'))
         return redirect(url_for('main.index'))
-    page = request.args.get('page', 1, type=int)
-    posts = db.paginate(current_user.following_posts(), page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.index', page=posts.next_num) \
+    before = decode_cursor(request.args.get('before'))
+    after = decode_cursor(request.args.get('after'))
+    per_page = current_app.config['POSTS_PER_PAGE']
+    posts = KeysetPagination(
+        current_user.home_timeline(per_page + 1, before, after), per_page,
+        before, after)
+    next_url = url_for('main.index', before=posts.next_cursor) \
         if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) \
+    prev_url = url_for('main.index', after=posts.prev_cursor) \
         if posts.has_prev else None
     return render_template('index.html', title=_('Home'), form=form,
                            posts=posts.items, next_url=next_url,
@@ -54,14 +64,13 @@ def index():
 @bp.route('/explore')
 @login_required
 def explore():
-    page = request.args.get('page', 1, type=int)
-    query = sa.select(Post).order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.explore', page=posts.next_num) \
+    posts = paginate(sa.select(Post), Post.timestamp, Post.id,
+                     current_app.config['POSTS_PER_PAGE'],
+                     before=decode_cursor(request.args.get('before')),
+                     after=decode_cursor(request.args.get('after')))
+    next_url = url_for('main.explore', before=posts.next_cursor) \
         if posts.has_next else None
-    prev_url = url_for('main.explore', page=posts.prev_num) \
+    prev_url = url_for('main.explore', after=posts.prev_cursor) \
         if posts.has_prev else None
     return render_template('index.html', title=_('Explore'),
                            posts=posts.items, next_url=next_url,
@@ -72,15 +81,14 @@ def explore():
 @login_required
 def user(username):
     user = db.first_or_404(sa.select(User).where(User.username == username))
-    page = request.args.get('page', 1, type=int)
-    query = user.posts.select().order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
+    posts = paginate(user.posts.select(), Post.timestamp, Post.id,
+                     current_app.config['POSTS_PER_PAGE'],
+                     before=decode_cursor(request.args.get('before')),
+                     after=decode_cursor(request.args.get('after')))
     next_url = url_for('main.user', username=user.username,
-                       page=posts.next_num) if posts.has_next else None
+                       before=posts.next_cursor) if posts.has_next else None
     prev_url = url_for('main.user', username=user.username,
-                       page=posts.prev_num) if posts.has_prev else None
+                       after=posts.prev_cursor) if posts.has_prev else None
     form = EmptyForm()
     return render_template('user.html', user=user, posts=posts.items,
                            next_url=next_url, prev_url=prev_url, form=form)
@@ -157,6 +165,13 @@ def unfollow(username):
 @login_required
 def translate_text():
     data = request.get_json()
+    if 'texts' in data:
+        texts = data['texts']
+        if not isinstance(texts, list) or len(texts) > MAX_BATCH_SIZE or \
+                not all(isinstance(text, str) for text in texts):
+            abort(400)
+        return {'texts': translate_many(texts, data['source_language'],
+                                        data['dest_language'])}
     return {'text': translate(data['text'],
                               data['source_language'],
                               data['dest_language'])}
@@ -174,8 +189,8 @@ def search():
         if total > page * current_app.config['POSTS_PER_PAGE'] else None
     prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) \
         if page > 1 else None
-    return render_template('search.html', title=_('Search'), posts=posts,
-                           next_url=next_url, prev_url=prev_url)
+    return render_template('search.html', title=_('Search'),
+                           posts=list(posts), next_url=next_url, prev_url=prev_url)
 
 
 @bp.route('/send_message/<recipient>', methods=['GET', 'POST'])
@@ -187,6 +202,9 @@ def send_message(recipient):
         msg = Message(author=current_user, recipient=user,
                       body=form.message.data)
         db.session.add(msg)
+        # The flush bumps the counter in the database, and reading it back
+        # is a primary key lookup instead of a count of the messages
+        db.session.flush()
         user.add_notification('unread_message_count',
                               user.unread_message_count())
         db.session.commit()
@@ -200,17 +218,17 @@ def send_message(recipient):
 @login_required
 def messages():
     current_user.last_message_read_time = datetime.now(timezone.utc)
+    current_user.unread_messages = 0
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
-    page = request.args.get('page', 1, type=int)
-    query = current_user.messages_received.select().order_by(
-        Message.timestamp.desc())
-    messages = db.paginate(query, page=page,
-                           per_page=current_app.config['POSTS_PER_PAGE'],
-                           error_out=False)
-    next_url = url_for('main.messages', page=messages.next_num) \
+    messages = paginate(current_user.messages_received.select(),
+                        Message.timestamp, Message.id,
+                        current_app.config['POSTS_PER_PAGE'],
+                        before=decode_cursor(request.args.get('before')),
+                        after=decode_cursor(request.args.get('after')))
+    next_url = url_for('main.messages', before=messages.next_cursor) \
         if messages.has_next else None
-    prev_url = url_for('main.messages', page=messages.prev_num) \
+    prev_url = url_for('main.messages', after=messages.prev_cursor) \
         if messages.has_prev else None
     return render_template('messages.html', messages=messages.items,
                            next_url=next_url, prev_url=prev_url)
@@ -222,20 +240,97 @@ def export_posts():
     if current_user.get_task_in_progress('export_posts'):
         flash(_('An export task is currently in progress'))
     else:
-        current_user.launch_task('export_posts', _('Exporting posts...'))
+        current_user.launch_task('export_posts', _('Exporting posts...'),
+                                 url_root=request.url_root)
         db.session.commit()
     return redirect(url_for('main.user', username=current_user.username))
 
 
+@bp.route('/exports/<filename>')
+@login_required
+def download_export(filename):
+    task = db.session.get(Task, filename.split('.', 1)[0])
+    if task is None or task.user_id != current_user.id or \
+            task.name != 'export_posts':
+        abort(404)
+    accel_prefix = current_app.config['EXPORT_ACCEL_REDIRECT']
+    if accel_prefix:
+        # nginx serves the file from an internal location, with its own
+        # Range and ETag handling
+        response = Response(mimetype='application/octet-stream', headers={
+            'X-Accel-Redirect': accel_prefix.rstrip('/') + '/' + filename,
+            'Content-Disposition': 'attachment; filename=' + filename})
+    else:
+        # Werkzeug answers Range and If-None-Match requests itself and
+        # hands the open file to the server's file wrapper (sendfile)
+        response = send_from_directory(current_app.config['EXPORT_DIR'],
+                                       filename, as_attachment=True)
+    response.cache_control.private = True
+    return response
+
+
 @bp.route('/notifications')
 @login_required
 def notifications():
     since = request.args.get('since', 0.0, type=float)
+    marks = current_app.notification_marks
+    mark = marks.get(current_user.id)
+    if mark is None:
+        mark = Notification.latest(current_user.id) or 0.0
+        marks.seed(current_user.id, mark)
+    else:
+        # Nothing newer than the mark means nothing to send, which is
+        # answered without touching the database
+        etag = str(mark)
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"'})
+        if since >= mark:
+            return _notifications_response([], etag)
+    query = sa.select(Notification.name, Notification.payload_json,
+                      Notification.timestamp).where(
+        Notification.user_id == current_user.id,
+        Notification.timestamp > since).order_by(Notification.timestamp.asc())
+    # Running tasks report progress outside the database
+    items = [Notification.to_json('task_progress', json.dumps(
+        {'task_id': task.id, 'progress': progress}))
+        for task, progress in current_user.get_tasks_progress()]
+    items += [Notification.to_json(*row)
+              for row in db.session.execute(query)]
+    return _notifications_response(items, str(mark))
+
+
+def _notifications_response(items, etag):
+    response = Response('[' + ', '.join(items) + ']',
+                        mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/notifications/stream')
+@login_required
+def notification_stream():
+    since = max(request.args.get('since', 0.0, type=float),
+                request.headers.get('Last-Event-ID', 0.0, type=float))
+    subscription = current_app.broker.subscribe(
+        Notification.channel(current_user.id))
     query = current_user.notifications.select().where(
         Notification.timestamp > since).order_by(Notification.timestamp.asc())
-    notifications = db.session.scalars(query)
-    return [{
-        'name': n.name,
-        'data': n.get_data(),
-        'timestamp': n.timestamp
-    } for n in notifications]
+    backlog = [n.to_event() for n in db.session.scalars(query)]
+    timeout = current_app.config['NOTIFICATIONS_STREAM_TIMEOUT']
+    heartbeat = current_app.config['NOTIFICATIONS_STREAM_HEARTBEAT']
+
+    def stream():
+        try:
+            yield from backlog
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                event = subscription.get(
+                    min(heartbeat, max(deadline - time.monotonic(), 0)))
+                yield event if event is not None else ': keep-alive\n\n'
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
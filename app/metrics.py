@@ -0,0 +1,100 @@
+import threading
+from collections import defaultdict
+import redis
+from flask import current_app
+
+
+class Metrics:
+    def __init__(self, shared=None):
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = {}
+        self._gauges = {}
+
+    def incr(self, name, value=1, shared=False):
+        if shared and self.shared is not None:
+            self.shared.incr(name, value)
+            return
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, value, shared=False):
+        if shared and self.shared is not None:
+            self.shared.observe(name, value)
+            return
+        with self._lock:
+            count, total, maximum = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + value,
+                                   max(maximum, value))
+
+    def gauge(self, name, callback):
+        with self._lock:
+            self._gauges[name] = callback
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._counters)
+            for name, (count, total, maximum) in self._timings.items():
+                data[name] = {'count': count, 'avg': total / count,
+                              'max': maximum}
+            gauges = list(self._gauges.items())
+        for name, callback in gauges:
+            data[name] = callback()
+        if self.shared is not None:
+            data.update(self.shared.snapshot())
+        return data
+
+
+class RedisMetrics:
+    # Metrics recorded by background workers are kept here, where the web
+    # processes serving /api/metrics can read them
+    def __init__(self, connection, key='metrics'):
+        self.connection = connection
+        self.key = key
+
+    def incr(self, name, value=1):
+        try:
+            self.connection.hincrby(self.key + ':counters', name, value)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not record metric %s', name,
+                                       exc_info=True)
+
+    def observe(self, name, value):
+        pipeline = self.connection.pipeline(transaction=False)
+        pipeline.hincrby(self.key + ':timings', name + ':count', 1)
+        pipeline.hincrbyfloat(self.key + ':timings', name + ':total', value)
+        # GT keeps the largest value seen by any process
+        pipeline.zadd(self.key + ':max', {name: value}, gt=True)
+        try:
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not record metric %s', name,
+                                       exc_info=True)
+
+    def snapshot(self):
+        pipeline = self.connection.pipeline(transaction=False)
+        pipeline.hgetall(self.key + ':counters')
+        pipeline.hgetall(self.key + ':timings')
+        pipeline.zrange(self.key + ':max', 0, -1, withscores=True)
+        try:
+            counters, timings, maxima = pipeline.execute()
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not read shared metrics',
+                                       exc_info=True)
+            return {}
+        data = {_decode(name): int(value) for name, value in counters.items()}
+        maxima = {_decode(name): value for name, value in maxima}
+        timings = {_decode(field): value for field, value in timings.items()}
+        for name, maximum in maxima.items():
+            count = int(timings.get(name + ':count', 0))
+            if count:
+                data[name] = {
+                    'count': count,
+                    'avg': float(timings.get(name + ':total', 0)) / count,
+                    'max': maximum}
+        return data
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
@@ -1,5 +1,6 @@
 from datetime import datetime, timezone, timedelta
 from hashlib import md5
+import heapq
 import json
 import secrets
 from time import time
@@ -8,12 +9,14 @@ import sqlalchemy as sa
 import sqlalchemy.orm as so
 from flask import current_app, url_for
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import redis
 import rq
 from app import db, login
-from app.search import add_to_index, remove_from_index, query_index
+from app.cache import request_cached
+from app.pagination import keyset_select
+from app.search import document, query_index, queue_add_to_index, \
+    queue_remove_from_index, search_backend, fts5_enabled, FTS5Backend
 
 
 class SearchableMixin:
@@ -41,23 +44,51 @@ class SearchableMixin:
     def after_commit(cls, session):
         for obj in session._changes['add']:
             if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
+                queue_add_to_index(obj.__tablename__, obj)
         for obj in session._changes['update']:
             if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
+                queue_add_to_index(obj.__tablename__, obj)
         for obj in session._changes['delete']:
             if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
+                queue_remove_from_index(obj.__tablename__, obj)
         session._changes = None
 
     @classmethod
-    def reindex(cls):
-        for obj in db.session.scalars(sa.select(cls)):
-            add_to_index(cls.__tablename__, obj)
+    def after_flush(cls, session, flush_context):
+        # In-database indexes are written in the same transaction as the
+        # rows, instead of being queued for after the commit
+        if not fts5_enabled():
+            return
+        backend = FTS5Backend(session.connection())
+        for obj in session.new | session.dirty:
+            if isinstance(obj, SearchableMixin):
+                backend.add(obj.__tablename__, obj.id, document(obj))
+        for obj in session.deleted:
+            if isinstance(obj, SearchableMixin):
+                backend.remove(obj.__tablename__, obj.id)
+
+    @classmethod
+    def reindex(cls, chunk_size=1000, workers=4, index=None, start_after=0,
+                progress=None):
+        backend = search_backend()
+        if backend is None:
+            return None
+        return backend.rebuild(cls.__tablename__,
+                               cls.index_chunks(chunk_size, start_after),
+                               workers=workers, index=index,
+                               progress=progress, start_after=start_after)
+
+    @classmethod
+    def index_chunks(cls, chunk_size, start_after=0):
+        query = sa.select(cls).where(cls.id > start_after).order_by(
+            cls.id).execution_options(yield_per=chunk_size)
+        for objs in db.session.scalars(query).partitions():
+            yield objs[-1].id, [(obj.id, document(obj)) for obj in objs]
 
 
 db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 
 
 class PaginatedAPIMixin(object):
@@ -109,6 +140,16 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     token: so.Mapped[Optional[str]] = so.mapped_column(
         sa.String(32), index=True, unique=True)
     token_expiration: so.Mapped[Optional[datetime]]
+    token_version: so.Mapped[int] = so.mapped_column(default=0,
+                                                     server_default='0')
+    post_count: so.Mapped[int] = so.mapped_column(default=0,
+                                                  server_default='0')
+    follower_count: so.Mapped[int] = so.mapped_column(default=0,
+                                                      server_default='0')
+    followed_count: so.Mapped[int] = so.mapped_column(default=0,
+                                                      server_default='0')
+    unread_messages: so.Mapped[int] = so.mapped_column(default=0,
+                                                       server_default='0')
 
     posts: so.WriteOnlyMapped['Post'] = so.relationship(
         back_populates='author')
@@ -132,10 +173,15 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return '<User {}>'.format(self.username)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = current_app.passwords.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        passwords = current_app.passwords
+        if not passwords.verify(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.password_hash = passwords.hash(password)
+        return True
 
     def avatar(self, size):
         digest = md5(self.email.lower().encode('utf-8')).hexdigest()
@@ -144,40 +190,67 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     def follow(self, user):
         if not self.is_following(user):
             self.following.add(user)
+            self.adjust_counter('followed_count', 1)
+            user.adjust_counter('follower_count', 1)
+            Timeline.backfill(self, user)
 
     def unfollow(self, user):
         if self.is_following(user):
             self.following.remove(user)
+            self.adjust_counter('followed_count', -1)
+            user.adjust_counter('follower_count', -1)
+            Timeline.prune(self, user)
+            Timeline.unpull(user)
+
+    def adjust_counter(self, name, delta):
+        value = self.__dict__.get(name)
+        if isinstance(value, sa.ColumnElement):
+            setattr(self, name, value + delta)
+        elif sa.inspect(self).persistent:
+            setattr(self, name, getattr(User, name) + delta)
+        else:
+            setattr(self, name, (getattr(self, name) or 0) + delta)
 
     def is_following(self, user):
         query = self.following.select().where(User.id == user.id)
         return db.session.scalar(query) is not None
 
     def followers_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.followers.select().subquery())
-        return db.session.scalar(query)
+        return self.follower_count or 0
 
     def following_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.following.select().subquery())
-        return db.session.scalar(query)
+        return self.followed_count or 0
 
     def following_posts(self):
-        Author = so.aliased(User)
-        Follower = so.aliased(User)
         return (
             sa.select(Post)
-            .join(Post.author.of_type(Author))
-            .join(Author.followers.of_type(Follower), isouter=True)
-            .where(sa.or_(
-                Follower.id == self.id,
-                Author.id == self.id,
-            ))
-            .group_by(Post)
-            .order_by(Post.timestamp.desc())
+            .join(Timeline, Timeline.post_id == Post.id)
+            .where(Timeline.user_id == self.id)
+            .order_by(Timeline.timestamp.desc(), Timeline.post_id.desc())
         )
 
+    def pulled_authors(self):
+        return db.session.scalars(
+            self.following.select().with_only_columns(User.id).where(
+                User.follower_count >
+                current_app.config['TIMELINE_PULL_THRESHOLD'])).all()
+
+    def home_timeline(self, limit, before=None, after=None):
+        sources = [db.session.scalars(keyset_select(
+            self.following_posts(), Timeline.timestamp, Timeline.post_id,
+            limit, before, after)).all()]
+        authors = self.pulled_authors()
+        max_sources = current_app.config['TIMELINE_PULL_MAX_SOURCES']
+        pulled = [Post.user_id == author_id
+                  for author_id in authors[:max_sources]]
+        if authors[max_sources:]:
+            pulled.append(Post.user_id.in_(authors[max_sources:]))
+        for condition in pulled:
+            sources.append(db.session.scalars(keyset_select(
+                sa.select(Post).where(condition), Post.timestamp, Post.id,
+                limit, before, after)).all())
+        return Timeline.merge(sources, limit, reverse=after is None)
+
     def get_reset_password_token(self, expires_in=600):
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
@@ -193,18 +266,15 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return db.session.get(User, id)
 
     def unread_message_count(self):
-        last_read_time = self.last_message_read_time or datetime(1900, 1, 1)
-        query = sa.select(Message).where(Message.recipient == self,
-                                         Message.timestamp > last_read_time)
-        return db.session.scalar(sa.select(sa.func.count()).select_from(
-            query.subquery()))
+        return self.unread_messages or 0
 
     def add_notification(self, name, data):
-        db.session.execute(self.notifications.delete().where(
-            Notification.name == name))
-        n = Notification(name=name, payload_json=json.dumps(data), user=self)
-        db.session.add(n)
-        return n
+        payload_json = json.dumps(data)
+        timestamp = time()
+        Notification.upsert(self.id, name, payload_json, timestamp)
+        db.session.info.setdefault('notifications', []).append(
+            (self.id, timestamp,
+             Notification.event(name, payload_json, timestamp)))
 
     def launch_task(self, name, description, *args, **kwargs):
         rq_job = current_app.task_queue.enqueue(f'app.tasks.{name}', self.id,
@@ -215,18 +285,51 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return task
 
     def get_tasks_in_progress(self):
-        query = self.tasks.select().where(Task.complete is False)
-        return db.session.scalars(query)
+        return [task for task, _ in self.get_tasks_progress()]
 
     def get_task_in_progress(self, name):
-        query = self.tasks.select().where(Task.name == name,
-                                          Task.complete is False)
-        return db.session.scalar(query)
+        for task in self.get_tasks_in_progress():
+            if task.name == name:
+                return task
+
+    def get_tasks_progress(self):
+        return self.navbar()['tasks']
+
+    @request_cached
+    def navbar(self):
+        # The unread count is a column of the user, so the running tasks are
+        # the only query
+        tasks = db.session.scalars(self.tasks.select().where(
+            Task.complete.is_(False))).all()
+        progress = current_app.task_progress.get_many(
+            task.id for task in tasks) if tasks else {}
+        return {
+            'unread_message_count': self.unread_message_count(),
+            'tasks': [(task, progress[task.id]) for task in tasks],
+        }
 
     def posts_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.posts.select().subquery())
-        return db.session.scalar(query)
+        return self.post_count or 0
+
+    @classmethod
+    def reconcile_counters(cls):
+        Followed = so.aliased(followers)
+        db.session.execute(sa.update(cls).values(
+            post_count=sa.select(sa.func.count(Post.id)).where(
+                Post.user_id == cls.id).scalar_subquery(),
+            follower_count=sa.select(sa.func.count()).select_from(
+                followers).where(
+                    followers.c.followed_id == cls.id).scalar_subquery(),
+            followed_count=sa.select(sa.func.count()).select_from(
+                Followed).where(
+                    Followed.c.follower_id == cls.id).scalar_subquery(),
+            unread_messages=sa.select(sa.func.count(Message.id)).where(
+                Message.recipient_id == cls.id, sa.or_(
+                    cls.last_message_read_time.is_(None),
+                    Message.timestamp > cls.last_message_read_time))
+            .scalar_subquery(),
+        ), execution_options={'synchronize_session': False})
+        db.session.expire_all()
 
     def to_dict(self, include_email=False):
         data = {
@@ -235,9 +338,9 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             'last_seen': self.last_seen.replace(
                 tzinfo=timezone.utc).isoformat(),
             'about_me': self.about_me,
-            'post_count': self.posts_count(),
-            'follower_count': self.followers_count(),
-            'following_count': self.following_count(),
+            'post_count': self.post_count,
+            'follower_count': self.follower_count,
+            'following_count': self.followed_count,
             '_links': {
                 'self': url_for('api.get_user', id=self.id),
                 'followers': url_for('api.get_followers', id=self.id),
@@ -257,6 +360,11 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             self.set_password(data['password'])
 
     def get_token(self, expires_in=3600):
+        if current_app.config['API_TOKENS_SIGNED']:
+            return jwt.encode(
+                {'api_token': self.id, 'version': self.token_version,
+                 'exp': time() + expires_in},
+                current_app.config['SECRET_KEY'], algorithm='HS256')
         now = datetime.now(timezone.utc)
         if self.token and self.token_expiration.replace(
                 tzinfo=timezone.utc) > now + timedelta(seconds=60):
@@ -269,19 +377,85 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     def revoke_token(self):
         self.token_expiration = datetime.now(timezone.utc) - timedelta(
             seconds=1)
+        # Bumping the version revokes every signed token issued so far
+        self.token_version = self.token_version + 1
 
     @staticmethod
     def check_token(token):
-        user = db.session.scalar(sa.select(User).where(User.token == token))
+        if '.' in token:
+            return User.check_signed_token(token)
+        id = current_app.user_cache.get(('token', token))
+        user = User.cached(id) if id is not None else None
+        if user is None or user.token != token:
+            user = db.session.scalar(
+                sa.select(User).where(User.token == token))
+            if user is not None:
+                user.cache()
+                current_app.user_cache.put(('token', token), user.id)
         if user is None or user.token_expiration.replace(
                 tzinfo=timezone.utc) < datetime.now(timezone.utc):
             return None
         return user
 
+    @staticmethod
+    def check_signed_token(token):
+        try:
+            payload = jwt.decode(token, current_app.config['SECRET_KEY'],
+                                 algorithms=['HS256'])
+            id, version = payload['api_token'], payload['version']
+        except (jwt.InvalidTokenError, KeyError):
+            return None
+        # The version is read from the cached user, and only goes to the
+        # database once the cache entry has expired or been invalidated
+        user = User.cached(id)
+        if user is None or user.token_version != version:
+            return None
+        return user
+
+    @classmethod
+    def cached(cls, id):
+        user = current_app.user_cache.get(('user', id))
+        if user is not None:
+            return db.session.merge(user, load=False)
+        user = db.session.get(cls, id)
+        if user is not None:
+            user.cache()
+        return user
+
+    def cache(self):
+        # Cache a detached copy, so no session's instance is ever shared
+        # between requests
+        copy = User(**{attr.key: getattr(self, attr.key)
+                       for attr in sa.inspect(User).column_attrs})
+        so.make_transient_to_detached(copy)
+        current_app.user_cache.put(('user', self.id), copy)
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        ids = session.info.setdefault('changed_users', set())
+        for obj in session.dirty | session.deleted:
+            if isinstance(obj, User):
+                ids.add(obj.id)
+
+    @classmethod
+    def after_commit(cls, session):
+        ids = session.info.pop('changed_users', None)
+        if ids:
+            current_app.user_cache.invalidate([('user', id) for id in ids])
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('changed_users', None)
+
+
+db.event.listen(db.session, 'after_flush', User.after_flush)
+db.event.listen(db.session, 'after_commit', User.after_commit)
+db.event.listen(db.session, 'after_rollback', User.after_rollback)
+
 
 @login.user_loader
 def load_user(id):
-    return db.session.get(User, int(id))
+    return User.cached(int(id))
 
 
 class Post(SearchableMixin, db.Model):
@@ -294,11 +468,150 @@ class Post(SearchableMixin, db.Model):
                                                index=True)
     language: so.Mapped[Optional[str]] = so.mapped_column(sa.String(5))
 
-    author: so.Mapped[User] = so.relationship(back_populates='posts')
+    author: so.Mapped[User] = so.relationship(back_populates='posts',
+                                              lazy='joined', innerjoin=True)
+
+    __table_args__ = (
+        sa.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+    )
 
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
+    @classmethod
+    def before_flush(cls, session, flush_context, instances):
+        deltas = {}
+        for obj in session.new:
+            if isinstance(obj, Post):
+                author = obj.author or session.get(User, obj.user_id)
+                deltas[author] = deltas.get(author, 0) + 1
+        for obj in session.deleted:
+            if isinstance(obj, Post):
+                author = obj.author or session.get(User, obj.user_id)
+                deltas[author] = deltas.get(author, 0) - 1
+        for author, delta in deltas.items():
+            if author is not None and delta:
+                author.adjust_counter('post_count', delta)
+
+
+class Timeline(db.Model):
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
+                                               primary_key=True)
+    post_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Post.id),
+                                               primary_key=True)
+    timestamp: so.Mapped[datetime]
+
+    __table_args__ = (
+        sa.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp',
+                 'post_id'),
+    )
+
+    @staticmethod
+    def is_pulled(connection, user_id):
+        follower_count = connection.scalar(
+            sa.select(User.follower_count).where(User.id == user_id))
+        return (follower_count or 0) > \
+            current_app.config['TIMELINE_PULL_THRESHOLD']
+
+    @staticmethod
+    def merge(sources, limit, reverse=True):
+        posts = []
+        for post in heapq.merge(*sources, key=lambda p: (p.timestamp, p.id),
+                                reverse=reverse):
+            if posts and posts[-1].id == post.id:
+                continue
+            posts.append(post)
+            if len(posts) == limit:
+                break
+        return posts
+
+    @classmethod
+    def push(cls, connection, post):
+        connection.execute(sa.insert(cls).values(
+            user_id=post.user_id, post_id=post.id, timestamp=post.timestamp))
+        if cls.is_pulled(connection, post.user_id):
+            return
+        connection.execute(sa.insert(cls).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            sa.select(followers.c.follower_id, sa.literal(post.id),
+                      sa.literal(post.timestamp, sa.DateTime))
+            .where(followers.c.followed_id == post.user_id,
+                   followers.c.follower_id != post.user_id)))
+
+    @classmethod
+    def backfill(cls, user, followed):
+        if not sa.inspect(user).persistent or \
+                not sa.inspect(followed).persistent or \
+                cls.is_pulled(db.session.connection(), followed.id):
+            return
+        db.session.execute(sa.insert(cls).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            sa.select(sa.literal(user.id), Post.id, Post.timestamp)
+            .where(Post.user_id == followed.id)))
+
+    @classmethod
+    def unpull(cls, author):
+        # Posts written while the author was pulled were never pushed, so
+        # once they drop back to the threshold every follower is backfilled
+        # before pulled_authors stops merging them in
+        if not sa.inspect(author).persistent:
+            return
+        follower_count = db.session.scalar(
+            sa.select(User.follower_count).where(User.id == author.id))
+        if follower_count != current_app.config['TIMELINE_PULL_THRESHOLD']:
+            return
+        db.session.execute(sa.insert(cls).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            sa.select(followers.c.follower_id, Post.id, Post.timestamp)
+            .join(followers, followers.c.followed_id == Post.user_id)
+            .where(Post.user_id == author.id,
+                   followers.c.follower_id != author.id,
+                   ~sa.exists().where(cls.user_id == followers.c.follower_id,
+                                      cls.post_id == Post.id))))
+
+    @classmethod
+    def prune(cls, user, followed):
+        if not sa.inspect(user).persistent or \
+                not sa.inspect(followed).persistent:
+            return
+        db.session.execute(sa.delete(cls).where(
+            cls.user_id == user.id,
+            cls.post_id.in_(sa.select(Post.id).where(
+                Post.user_id == followed.id))))
+
+    @classmethod
+    def rebuild(cls):
+        db.session.execute(sa.delete(cls))
+        db.session.execute(sa.insert(cls).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            sa.select(Post.user_id, Post.id, Post.timestamp)))
+        pulled = sa.select(User.id).where(
+            User.follower_count > current_app.config['TIMELINE_PULL_THRESHOLD'])
+        db.session.execute(sa.insert(cls).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            sa.select(followers.c.follower_id, Post.id, Post.timestamp)
+            .join(followers, followers.c.followed_id == Post.user_id)
+            .where(followers.c.follower_id != Post.user_id,
+                   Post.user_id.not_in(pulled))))
+
+    @classmethod
+    def before_flush(cls, session, flush_context, instances):
+        ids = [obj.id for obj in session.deleted if isinstance(obj, Post)]
+        if ids:
+            session.connection().execute(
+                sa.delete(cls).where(cls.post_id.in_(ids)))
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        for obj in session.new:
+            if isinstance(obj, Post):
+                cls.push(session.connection(), obj)
+
+
+db.event.listen(db.session, 'before_flush', Post.before_flush)
+db.event.listen(db.session, 'before_flush', Timeline.before_flush)
+db.event.listen(db.session, 'after_flush', Timeline.after_flush)
+
 
 class Message(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -312,28 +625,136 @@ class Message(db.Model):
 
     author: so.Mapped[User] = so.relationship(
         foreign_keys='Message.sender_id',
-        back_populates='messages_sent')
+        back_populates='messages_sent', lazy='joined', innerjoin=True)
     recipient: so.Mapped[User] = so.relationship(
         foreign_keys='Message.recipient_id',
         back_populates='messages_received')
 
+    __table_args__ = (
+        sa.Index('ix_message_recipient_id_timestamp', 'recipient_id',
+                 'timestamp'),
+    )
+
     def __repr__(self):
         return '<Message {}>'.format(self.body)
 
+    @classmethod
+    def before_flush(cls, session, flush_context, instances):
+        deltas = {}
+        for obj in session.new:
+            if isinstance(obj, Message):
+                recipient = obj.recipient or \
+                    session.get(User, obj.recipient_id)
+                deltas[recipient] = deltas.get(recipient, 0) + 1
+        for recipient, delta in deltas.items():
+            if recipient is not None:
+                recipient.adjust_counter('unread_messages', delta)
+
+
+db.event.listen(db.session, 'before_flush', Message.before_flush)
+
 
 class Notification(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
-    name: so.Mapped[str] = so.mapped_column(sa.String(128), index=True)
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
-                                               index=True)
+    name: so.Mapped[str] = so.mapped_column(sa.String(128))
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     timestamp: so.Mapped[float] = so.mapped_column(index=True, default=time)
     payload_json: so.Mapped[str] = so.mapped_column(sa.Text)
 
     user: so.Mapped[User] = so.relationship(back_populates='notifications')
 
+    __table_args__ = (
+        sa.UniqueConstraint('user_id', 'name',
+                            name='uq_notification_user_id_name'),
+        sa.Index('ix_notification_user_id_timestamp', 'user_id',
+                 'timestamp'),
+    )
+
     def get_data(self):
         return json.loads(str(self.payload_json))
 
+    def to_event(self):
+        return self.event(self.name, self.payload_json, self.timestamp)
+
+    @staticmethod
+    def to_json(name, payload_json, timestamp=None):
+        # Payloads are stored serialized and spliced into the output as they
+        # are, without a decode and re-encode per row
+        fields = ['"name": ' + json.dumps(name), '"data": ' + payload_json]
+        if timestamp is not None:
+            fields.append('"timestamp": ' + json.dumps(timestamp))
+        return '{' + ', '.join(fields) + '}'
+
+    @classmethod
+    def event(cls, name, payload_json, timestamp):
+        return 'id: {}\ndata: {}\n\n'.format(
+            timestamp, cls.to_json(name, payload_json, timestamp))
+
+    @classmethod
+    def live_event(cls, name, data):
+        # Live events are not stored, so they carry no id or timestamp and
+        # never move a client's resume point
+        return 'data: {}\n\n'.format(cls.to_json(name, json.dumps(data)))
+
+    @classmethod
+    def upsert(cls, user_id, name, payload_json, timestamp):
+        values = {'user_id': user_id, 'name': name,
+                  'payload_json': payload_json, 'timestamp': timestamp}
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            db.session.execute(sa.delete(cls).where(
+                cls.user_id == user_id, cls.name == name))
+            db.session.execute(sa.insert(cls).values(values))
+            return
+        statement = insert(cls).values(values)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', 'name'], set_={
+                'payload_json': statement.excluded.payload_json,
+                'timestamp': statement.excluded.timestamp}))
+
+    @classmethod
+    def sweep(cls, max_age, batch_size=1000):
+        # Deleting in batches keeps each transaction, and the locks it holds,
+        # short
+        cutoff = time() - max_age
+        removed = 0
+        while True:
+            ids = db.session.scalars(sa.select(cls.id).where(
+                cls.timestamp < cutoff).limit(batch_size)).all()
+            if not ids:
+                return removed
+            db.session.execute(sa.delete(cls).where(cls.id.in_(ids)))
+            db.session.commit()
+            removed += len(ids)
+
+    @staticmethod
+    def channel(user_id):
+        return f'notifications:{user_id}'
+
+    @classmethod
+    def after_commit(cls, session):
+        for user_id, timestamp, event in session.info.pop('notifications',
+                                                          []):
+            current_app.notification_marks.advance(user_id, timestamp)
+            current_app.broker.publish(cls.channel(user_id), event)
+
+    @classmethod
+    def latest(cls, user_id):
+        return db.session.scalar(sa.select(sa.func.max(cls.timestamp)).where(
+            cls.user_id == user_id))
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('notifications', None)
+
+
+db.event.listen(db.session, 'after_commit', Notification.after_commit)
+db.event.listen(db.session, 'after_rollback', Notification.after_rollback)
+
 
 class Task(db.Model):
     id: so.Mapped[str] = so.mapped_column(sa.String(36), primary_key=True)
@@ -352,5 +773,4 @@ class Task(db.Model):
         return rq_job
 
     def get_progress(self):
-        job = self.get_rq_job()
-        return job.meta.get('progress', 0) if job is not None else 100
+        return current_app.task_progress.get_many([self.id])[self.id]
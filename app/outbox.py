@@ -0,0 +1,228 @@
+import atexit
+import base64
+import json
+import queue
+import smtplib
+import threading
+import time
+import weakref
+import redis
+from flask import current_app
+from flask_mail import Message
+
+
+def dump_message(msg):
+    return {
+        'subject': msg.subject, 'sender': msg.sender,
+        'recipients': msg.recipients, 'cc': msg.cc, 'bcc': msg.bcc,
+        'reply_to': msg.reply_to, 'body': msg.body, 'html': msg.html,
+        'attachments': [{
+            'filename': attachment.filename,
+            'content_type': attachment.content_type,
+            'data': base64.b64encode(
+                attachment.data.encode('utf-8')
+                if isinstance(attachment.data, str)
+                else attachment.data).decode('ascii'),
+            'disposition': attachment.disposition,
+        } for attachment in msg.attachments],
+    }
+
+
+def load_message(data):
+    msg = Message(data['subject'], sender=data['sender'],
+                  recipients=data['recipients'], cc=data['cc'],
+                  bcc=data['bcc'], reply_to=data['reply_to'],
+                  body=data['body'], html=data['html'])
+    for attachment in data['attachments']:
+        msg.attach(attachment['filename'], attachment['content_type'],
+                   base64.b64decode(attachment['data']),
+                   attachment['disposition'])
+    return msg
+
+
+class LocalOutboxQueue:
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def get(self, timeout):
+        try:
+            if timeout <= 0:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __len__(self):
+        return self._queue.qsize()
+
+
+class RedisOutboxQueue:
+    def __init__(self, connection, key='mail:outbox'):
+        self.connection = connection
+        self.key = key
+        # Messages that could not be stored in Redis are kept in process,
+        # where this process's workers still send them
+        self.fallback = LocalOutboxQueue()
+
+    def put(self, item):
+        try:
+            self.connection.rpush(self.key, json.dumps(item))
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not write to the outbox',
+                                       exc_info=True)
+            self.fallback.put(item)
+
+    def get(self, timeout):
+        item = self.fallback.get(timeout=0)
+        if item is not None:
+            return item
+        try:
+            if timeout <= 0:
+                value = self.connection.lpop(self.key)
+            else:
+                # BLPOP only takes whole seconds and treats 0 as forever
+                popped = self.connection.blpop(self.key,
+                                               timeout=max(1, int(timeout)))
+                value = popped[1] if popped else None
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not read the outbox',
+                                       exc_info=True)
+            time.sleep(1)
+            return None
+        try:
+            return json.loads(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    def __len__(self):
+        try:
+            return int(self.connection.llen(self.key)) + len(self.fallback)
+        except redis.exceptions.RedisError:
+            return len(self.fallback)
+
+
+class Outbox:
+    def __init__(self, app, mail, queue, workers=2, linger=1.0,
+                 idle_timeout=30.0, max_retries=3, backoff=1.0,
+                 exit_timeout=10.0):
+        self.app = app
+        self.mail = mail
+        self.queue = queue
+        self.workers = workers
+        self.linger = linger
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.exit_timeout = exit_timeout
+        self._threads = []
+        self._lock = threading.Lock()
+        app.metrics.gauge('email.queue_depth', lambda: len(self.queue))
+
+    def put(self, msg):
+        self.queue.put({'message': dump_message(msg), 'queued': time.time(),
+                        'attempts': 0})
+        _started_outboxes.add(self)
+        self._start()
+
+    def _start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads
+                             if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                item = self.queue.get(timeout=self.idle_timeout)
+                if item is not None:
+                    try:
+                        self.drain(item)
+                    except Exception:
+                        self.app.logger.exception('Outbox worker error')
+
+    def drain(self, item=None):
+        # Everything waiting goes out over one connection, so a burst costs
+        # a single SMTP handshake per worker instead of one per message
+        item = item or self.queue.get(timeout=0)
+        if item is None:
+            return
+        try:
+            with self.mail.connect() as connection:
+                while item is not None:
+                    self._send(connection, item)
+                    item = self.queue.get(timeout=self.linger)
+        except (smtplib.SMTPException, OSError):
+            self.app.logger.warning('Could not send email', exc_info=True)
+            if item is not None:
+                self._retry(item)
+
+    def drain_local(self):
+        # Workers are daemon threads, so messages held in this process are
+        # sent here before it exits. Messages in Redis outlive the process
+        local = getattr(self.queue, 'fallback', self.queue)
+        deadline = time.monotonic() + self.exit_timeout
+        item = local.get(timeout=0)
+        if item is None:
+            return
+        try:
+            with self.mail.connect() as connection:
+                while item is not None and time.monotonic() < deadline:
+                    self._send(connection, item)
+                    item = local.get(timeout=0)
+        except (smtplib.SMTPException, OSError):
+            self.app.logger.warning('Could not send email', exc_info=True)
+        if item is not None:
+            self.app.metrics.incr('email.failed', len(local) + 1)
+            self.app.logger.error('Dropping %d queued emails at exit',
+                                  len(local) + 1)
+
+    def _send(self, connection, item):
+        try:
+            connection.send(load_message(item['message']))
+        except (smtplib.SMTPException, OSError):
+            raise
+        except Exception:
+            # A message that cannot be built (bad headers, a malformed
+            # item) would fail every retry too, so it is dropped
+            self.app.metrics.incr('email.failed')
+            self.app.logger.exception('Dropping email that cannot be sent')
+            return
+        self.app.metrics.incr('email.sent')
+        self.app.metrics.observe('email.send_latency',
+                                 time.time() - item['queued'])
+
+    def _retry(self, item):
+        item['attempts'] += 1
+        if item['attempts'] > self.max_retries:
+            self.app.metrics.incr('email.failed')
+            self.app.logger.error('Giving up on email to %s',
+                                  ', '.join(item['message']['recipients']))
+            return
+        self.app.metrics.incr('email.retries')
+        time.sleep(self.backoff * 2 ** (item['attempts'] - 1))
+        self.queue.put(item)
+
+
+_started_outboxes = weakref.WeakSet()
+
+
+def _drain_outbox(outbox):
+    with outbox.app.app_context():
+        outbox.drain_local()
+
+
+@atexit.register
+def _drain_started_outboxes():
+    # A thread bounds the wait, as connecting to the SMTP server has no
+    # timeout of its own
+    for outbox in list(_started_outboxes):
+        thread = threading.Thread(target=_drain_outbox, args=(outbox,),
+                                  daemon=True)
+        thread.start()
+        thread.join(outbox.exit_timeout)
@@ -0,0 +1,76 @@
+import base64
+import binascii
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from app import db
+
+
+def encode_cursor(timestamp, id):
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    value = '{}|{}'.format(timestamp.isoformat(), id).encode('utf-8')
+    return base64.urlsafe_b64encode(value).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, id = value.decode('utf-8').split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def keyset_select(query, timestamp, id, limit, before=None, after=None):
+    query = query.order_by(None)
+    if after is not None:
+        return query.where(sa.or_(
+            timestamp > after[0],
+            sa.and_(timestamp == after[0], id > after[1]),
+        )).order_by(timestamp.asc(), id.asc()).limit(limit)
+    if before is not None:
+        query = query.where(sa.or_(
+            timestamp < before[0],
+            sa.and_(timestamp == before[0], id < before[1]),
+        ))
+    return query.order_by(timestamp.desc(), id.desc()).limit(limit)
+
+
+class KeysetPagination:
+    def __init__(self, items, per_page, before=None, after=None, total=None):
+        more = len(items) > per_page
+        self.items = list(items[:per_page])
+        if after is not None:
+            self.items.reverse()
+            self.has_prev, self.has_next = more, True
+        else:
+            self.has_prev, self.has_next = before is not None, more
+        if not self.items:
+            self.has_prev = self.has_next = False
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return encode_cursor(self.items[-1].timestamp, self.items[-1].id)
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev:
+            return None
+        return encode_cursor(self.items[0].timestamp, self.items[0].id)
+
+
+def paginate(query, timestamp, id, per_page, before=None, after=None,
+             count=False):
+    items = db.session.scalars(keyset_select(
+        query, timestamp, id, per_page + 1, before, after)).all()
+    total = None
+    if count:
+        total = db.session.scalar(sa.select(sa.func.count()).select_from(
+            query.order_by(None).subquery()))
+    return KeysetPagination(items, per_page, before, after, total)
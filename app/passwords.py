@@ -0,0 +1,85 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash, \
+    DEFAULT_PBKDF2_ITERATIONS
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+
+class PasswordHasherBusy(ServiceUnavailable):
+    description = 'Too many password checks are in progress, please retry.'
+
+
+def normalize_method(method):
+    # Spell out Werkzeug's defaults so stored hashes can be compared with
+    # the configured method
+    name, *params = method.split(':')
+    if name == 'scrypt':
+        defaults = ['32768', '8', '1']
+    elif name == 'pbkdf2':
+        defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ':'.join([name] + params + defaults[len(params):])
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=None, queue_size=16,
+                 timeout=5.0):
+        self.method = normalize_method(method)
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._argon2 = None
+        name, *params = self.method.split(':')
+        if name == 'argon2':
+            if argon2 is None:
+                raise RuntimeError('argon2 hashing needs argon2-cffi')
+            # argon2:<time cost>:<memory cost in KiB>:<parallelism>
+            self._argon2 = argon2.PasswordHasher(*map(int, params))
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='password-hasher')
+
+    def hash(self, password):
+        return self._run(self._hash, password)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(self._verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        if self._argon2 is not None:
+            return not password_hash.startswith('$argon2') or \
+                self._argon2.check_needs_rehash(password_hash)
+        return password_hash.split('$', 1)[0] != self.method
+
+    def _hash(self, password):
+        if self._argon2 is not None:
+            return self._argon2.hash(password)
+        return generate_password_hash(password, self.method)
+
+    def _verify(self, password_hash, password):
+        if not password_hash.startswith('$argon2'):
+            return check_password_hash(password_hash, password)
+        if argon2 is None:
+            return False
+        try:
+            return argon2.PasswordHasher().verify(password_hash, password)
+        except (argon2.exceptions.VerificationError,
+                argon2.exceptions.InvalidHashError):
+            return False
+
+    def _run(self, function, *args):
+        # Hashing releases the GIL, so the pool uses every core, while the
+        # slots bound how much work can pile up behind it
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusy(retry_after=1)
+        try:
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
@@ -0,0 +1,93 @@
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+
+
+class LastSeenBuffer:
+    def __init__(self, model, granularity=60, flush_interval=30):
+        self.model = model
+        self.granularity = timedelta(seconds=granularity)
+        self.flush_interval = flush_interval
+        self._pending = {}
+        # The user passed to touch() may be a cached copy whose last_seen
+        # predates recent flushes, so what was written is remembered here
+        self._flushed = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._app = None
+        self._thread = None
+
+    def touch(self, user, now=None):
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            last_seen = self._pending.get(user.id) or \
+                self._flushed.get(user.id) or user.last_seen
+            if last_seen is not None and last_seen.tzinfo is None:
+                last_seen = last_seen.replace(tzinfo=timezone.utc)
+            if last_seen is None or now - last_seen >= self.granularity:
+                self._pending[user.id] = now
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if self._thread is None:
+                # Times queued before a worker goes idle are flushed by
+                # the timer instead of waiting for another request
+                self._app = current_app._get_current_object()
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+                _started_buffers.add(self)
+        if due:
+            self.flush()
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                time.sleep(max(self.flush_interval, 0.1))
+                with self._lock:
+                    due = time.monotonic() - self._last_flush >= \
+                        self.flush_interval
+                if due:
+                    self.flush()
+                    db.session.remove()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            db.session.execute(sa.update(self.model), [
+                {'id': id, 'last_seen': last_seen}
+                for id, last_seen in pending.items()])
+            db.session.commit()
+        except sa.exc.SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.warning('Could not flush last seen times',
+                                       exc_info=True)
+            with self._lock:
+                for id, last_seen in pending.items():
+                    self._pending.setdefault(id, last_seen)
+            return
+        with self._lock:
+            self._flushed.update(pending)
+            # Older times can no longer hold back a write, so they are
+            # dropped to keep the map to recently active users
+            cutoff = datetime.now(timezone.utc) - self.granularity
+            for id in [id for id, last_seen in self._flushed.items()
+                       if last_seen < cutoff]:
+                del self._flushed[id]
+
+
+_started_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_started_buffers():
+    for buffer in list(_started_buffers):
+        with buffer._app.app_context():
+            buffer.flush()
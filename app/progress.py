@@ -0,0 +1,66 @@
+import threading
+import time
+import redis
+import rq
+from flask import current_app
+
+
+class LocalTaskProgress:
+    def __init__(self):
+        self._progress = {}
+        self._lock = threading.Lock()
+
+    def set(self, task_id, progress):
+        with self._lock:
+            previous = self._progress.get(task_id)
+            self._progress[task_id] = progress
+        return previous
+
+    def get_many(self, task_ids):
+        with self._lock:
+            return {task_id: self._progress.get(task_id, 0)
+                    for task_id in task_ids}
+
+
+class RedisTaskProgress:
+    def __init__(self, connection, ttl=86400):
+        self.connection = connection
+        self.ttl = ttl
+
+    @staticmethod
+    def key(task_id):
+        return f'task-progress:{task_id}'
+
+    def set(self, task_id, progress):
+        pipeline = self.connection.pipeline(transaction=False)
+        pipeline.hget(self.key(task_id), 'progress')
+        pipeline.hset(self.key(task_id), mapping={
+            'progress': progress, 'timestamp': time.time()})
+        pipeline.expire(self.key(task_id), self.ttl)
+        previous = pipeline.execute()[0]
+        return int(previous) if previous is not None else None
+
+    def get_many(self, task_ids):
+        task_ids = list(task_ids)
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for task_id in task_ids:
+                pipeline.hget(self.key(task_id), 'progress')
+            values = pipeline.execute()
+            progress = {task_id: int(value)
+                        for task_id, value in zip(task_ids, values)
+                        if value is not None}
+            # Tasks that have not reported yet are either still queued or
+            # gone, which the jobs themselves tell in a single round trip
+            missing = [task_id for task_id in task_ids
+                       if task_id not in progress]
+            jobs = rq.job.Job.fetch_many(missing, connection=self.connection) \
+                if missing else []
+        except (redis.exceptions.RedisError, rq.exceptions.NoSuchJobError):
+            current_app.logger.warning('Could not read task progress',
+                                       exc_info=True)
+            return {task_id: 100 for task_id in task_ids}
+        for task_id, job in zip(missing, jobs):
+            progress[task_id] = job.meta.get('progress', 0) \
+                if job is not None else 100
+        return progress
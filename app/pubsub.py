@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+import redis
+from flask import current_app
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def subscribe(self, channel):
+        return LocalSubscription(self, channel)
+
+
+class LocalSubscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self._queue = queue.Queue()
+        with broker._lock:
+            broker._subscribers[channel].add(self._queue)
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with self.broker._lock:
+            subscribers = self.broker._subscribers.get(self.channel)
+            if subscribers is not None:
+                subscribers.discard(self._queue)
+                if not subscribers:
+                    del self.broker._subscribers[self.channel]
+
+
+class RedisBroker:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def publish(self, channel, message):
+        try:
+            self.connection.publish(channel, message)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not publish to %s', channel,
+                                       exc_info=True)
+
+    def subscribe(self, channel):
+        return RedisSubscription(self.connection, channel)
+
+
+class RedisSubscription:
+    def __init__(self, connection, channel):
+        # Streamed responses read from the subscription after the app
+        # context is gone, so the logger is bound up front
+        self.logger = current_app.logger
+        self._pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(channel)
+
+    def get(self, timeout):
+        try:
+            message = self._pubsub.get_message(timeout=timeout)
+        except redis.exceptions.RedisError:
+            self.logger.warning('Could not read from Redis', exc_info=True)
+            # Waiting out the timeout keeps callers from spinning while
+            # Redis is down
+            time.sleep(timeout)
+            return None
+        if message is None:
+            return None
+        data = message['data']
+        return data.decode('utf-8') if isinstance(data, bytes) else data
+
+    def close(self):
+        self._pubsub.close()
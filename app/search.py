@@ -1,28 +1,412 @@
+import atexit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+import time
+import weakref
+import sqlalchemy as sa
+from elasticsearch import ApiError, TransportError
 from flask import current_app
+from app import db
+
+
+class ElasticsearchBackend:
+    in_database = False
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, index, id, document):
+        self.client.index(index=index, id=id, document=document)
+
+    def remove(self, index, id):
+        self.client.delete(index=index, id=id)
+
+    def query(self, index, query, page, per_page):
+        search = self.client.search(
+            index=index,
+            query={'multi_match': {'query': query, 'fields': ['*']}},
+            from_=(page - 1) * per_page,
+            size=per_page)
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        return ids, search['hits']['total']['value']
+
+    def rebuild(self, alias, chunks, workers=4, index=None, progress=None,
+                start_after=0):
+        if start_after and index is None:
+            # A fresh index would only hold the rows after start_after
+            raise ValueError('Resuming a rebuild needs the index being built')
+        return rebuild_index(alias, chunks, workers=workers, index=index,
+                             progress=progress)
+
+
+class FTS5Backend:
+    in_database = True
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @staticmethod
+    def table(index):
+        return index + '_search'
+
+    def _create(self, index):
+        self.connection.execute(sa.text(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(content, '
+            "tokenize='unicode61 remove_diacritics 2')".format(
+                self.table(index))))
+
+    def add(self, index, id, document):
+        self.add_many(index, [(id, document)])
+
+    def add_many(self, index, documents):
+        self._create(index)
+        rows = [{'id': id, 'content': '\n'.join(
+            str(value) for value in document.values() if value is not None)}
+            for id, document in documents]
+        self.connection.execute(sa.text(
+            'DELETE FROM {} WHERE rowid = :id'.format(self.table(index))),
+            rows)
+        self.connection.execute(sa.text(
+            'INSERT INTO {} (rowid, content) VALUES (:id, :content)'.format(
+                self.table(index))), rows)
+
+    def remove(self, index, id):
+        self._create(index)
+        self.connection.execute(sa.text(
+            'DELETE FROM {} WHERE rowid = :id'.format(self.table(index))),
+            {'id': id})
+
+    def query(self, index, query, page, per_page):
+        # Quote every word so user input never reaches the FTS5 query
+        # syntax, and match any of them like the multi_match query does
+        terms = ' OR '.join('"{}"'.format(term)
+                            for term in re.findall(r'\w+', query))
+        if not terms:
+            return [], 0
+        self._create(index)
+        table = self.table(index)
+        ids = self.connection.scalars(sa.text(
+            'SELECT rowid FROM {0} WHERE {0} MATCH :terms '
+            'ORDER BY bm25({0}) LIMIT :limit OFFSET :offset'.format(table)),
+            {'terms': terms, 'limit': per_page,
+             'offset': (page - 1) * per_page}).all()
+        total = self.connection.scalar(sa.text(
+            'SELECT count(*) FROM {0} WHERE {0} MATCH :terms'.format(table)),
+            {'terms': terms})
+        return ids, total
+
+    def rebuild(self, alias, chunks, workers=None, index=None, progress=None,
+                start_after=0):
+        # The rebuild runs in the caller's transaction, so readers keep
+        # seeing the old contents until it is committed. A resumed rebuild
+        # keeps the rows indexed before start_after
+        self._create(alias)
+        table = self.table(alias)
+        if index is None and not start_after:
+            self.connection.execute(sa.text('DELETE FROM ' + table))
+        total = 0
+        for last_id, documents in chunks:
+            self.add_many(alias, documents)
+            total += len(documents)
+            if progress is not None:
+                progress(table, last_id, total)
+        return table
+
+
+def fts5_enabled():
+    # FTS5 is an SQLite extension, other databases fall back to
+    # Elasticsearch whatever SEARCH_BACKEND says
+    return current_app.config.get('SEARCH_BACKEND') == 'fts5' and \
+        db.engine.dialect.name == 'sqlite'
+
+
+def search_backend():
+    if fts5_enabled():
+        return FTS5Backend(db.session.connection())
+    if current_app.elasticsearch:
+        return ElasticsearchBackend(current_app.elasticsearch)
+    return None
 
 
 def add_to_index(index, model):
-    if not current_app.elasticsearch:
+    backend = search_backend()
+    if backend is None:
         return
-    payload = {}
-    for field in model.__searchable__:
-        payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, document=payload)
+    backend.add(index, model.id, document(model))
 
 
 def remove_from_index(index, model):
-    if not current_app.elasticsearch:
+    backend = search_backend()
+    if backend is None:
         return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+    backend.remove(index, model.id)
 
 
 def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
+    backend = search_backend()
+    if backend is None:
         return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        query={'multi_match': {'query': query, 'fields': ['*']}},
-        from_=(page - 1) * per_page,
-        size=per_page)
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+    return backend.query(index, query, page, per_page)
+
+
+def document(model):
+    return {field: getattr(model, field) for field in model.__searchable__}
+
+
+def _queued():
+    return not fts5_enabled() and \
+        current_app.elasticsearch
+
+
+def queue_add_to_index(index, model):
+    if not _queued():
+        return
+    current_app.search_queue.put(index, model.id, document(model))
+
+
+def queue_remove_from_index(index, model):
+    if not _queued():
+        return
+    current_app.search_queue.put(index, model.id, None)
+
+
+def rebuild_alias(alias):
+    return alias + '-rebuild'
+
+
+def rebuild_index(alias, chunks, workers=4, index=None, progress=None,
+                  settle=None):
+    es = current_app.elasticsearch
+    index = index or '{}-{}'.format(alias, time.strftime('%Y%m%d%H%M%S'))
+    if not es.indices.exists(index=index):
+        es.indices.create(index=index, settings={'refresh_interval': '-1'})
+    # Indexing queues send every change to the rebuild alias as well, so
+    # posts written during the rebuild reach the new index. Rows are only
+    # read once the queues have had time to notice the alias
+    point_rebuild_alias(alias, index)
+    if settle is None:
+        settle = current_app.config.get('SEARCH_REBUILD_CHECK_INTERVAL', 10.0)
+    time.sleep(settle)
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        inflight = deque()
+        for last_id, documents in chunks:
+            inflight.append((executor.submit(_bulk_index, es, index, documents),
+                             last_id, len(documents)))
+            # Chunks complete in order so last_id is always safe to resume
+            # from, and at most one chunk per worker is held in memory
+            while len(inflight) >= workers:
+                total += _wait_chunk(inflight.popleft(), index, progress,
+                                     total)
+        while inflight:
+            total += _wait_chunk(inflight.popleft(), index, progress, total)
+    es.indices.put_settings(index=index, settings={'refresh_interval': None})
+    es.indices.refresh(index=index)
+    swap_alias(alias, index)
+    return index
+
+
+def _bulk_index(es, index, documents):
+    # Documents are only created, so a newer version already written by an
+    # indexing queue is never overwritten with the row read earlier
+    operations = []
+    for id, document in documents:
+        operations.append({'create': {'_index': index, '_id': id}})
+        operations.append(document)
+    response = es.bulk(operations=operations)
+    if response.get('errors'):
+        for item in response['items']:
+            result = item['create']
+            if result.get('status', 200) >= 400 and result['status'] != 409:
+                raise RuntimeError('Could not index {}/{}: {}'.format(
+                    index, result['_id'], result.get('error')))
+
+
+def _wait_chunk(chunk, index, progress, total):
+    future, last_id, count = chunk
+    future.result()
+    if progress is not None:
+        progress(index, last_id, total + count)
+    return count
+
+
+def point_rebuild_alias(alias, index):
+    es = current_app.elasticsearch
+    building = rebuild_alias(alias)
+    actions = []
+    if es.indices.exists_alias(name=building):
+        for old in es.indices.get_alias(name=building):
+            if old != index:
+                actions.append({'remove': {'index': old, 'alias': building}})
+    actions.append({'add': {'index': index, 'alias': building}})
+    es.indices.update_aliases(actions=actions)
+
+
+def swap_alias(alias, index):
+    es = current_app.elasticsearch
+    building = rebuild_alias(alias)
+    actions = []
+    retired = []
+    if es.indices.exists_alias(name=alias):
+        for old in es.indices.get_alias(name=alias):
+            if old != index:
+                actions.append({'remove': {'index': old, 'alias': alias}})
+                retired.append(old)
+    elif es.indices.exists(index=alias):
+        # An index created before aliases were used has to make way in the
+        # same action, as an alias cannot share its name
+        actions.append({'remove_index': {'index': alias}})
+    actions.append({'add': {'index': index, 'alias': alias}})
+    if es.indices.exists_alias(name=building, index=index):
+        actions.append({'remove': {'index': index, 'alias': building}})
+    es.indices.update_aliases(actions=actions)
+    # Old indices are only dropped once the alias has moved off them
+    for old in retired:
+        es.indices.delete(index=old)
+
+
+class IndexingQueue:
+    def __init__(self, app, batch_size=500, flush_interval=1.0,
+                 max_retries=5, backoff=0.5, rebuild_check_interval=10.0):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rebuild_check_interval = rebuild_check_interval
+        self._rebuilding = {}
+        self._pending = {}
+        self._inflight_since = None
+        self._cond = threading.Condition()
+        self._thread = None
+        app.metrics.gauge('search.index_lag', self.lag)
+        app.metrics.gauge('search.queue_depth', lambda: len(self._pending))
+
+    def put(self, index, id, document):
+        with self._cond:
+            previous = self._pending.pop((index, id), None)
+            enqueued = previous[1] if previous else time.monotonic()
+            self._pending[(index, id)] = (document, enqueued)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                _started_queues.add(self)
+
+    def lag(self):
+        with self._cond:
+            oldest = [enqueued for _, enqueued in self._pending.values()]
+            if self._inflight_since is not None:
+                oldest.append(self._inflight_since)
+        return time.monotonic() - min(oldest) if oldest else 0.0
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval)
+            self.flush()
+
+    def _take(self):
+        with self._cond:
+            keys = list(self._pending)[:self.batch_size]
+            batch = {key: self._pending.pop(key) for key in keys}
+            if batch:
+                self._inflight_since = min(
+                    enqueued for _, enqueued in batch.values())
+        return batch
+
+    def _requeue(self, batch):
+        with self._cond:
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+
+    def flush(self, max_retries=None):
+        batch = self._take()
+        while batch:
+            try:
+                sent = self._send(batch, max_retries)
+            finally:
+                with self._cond:
+                    self._inflight_since = None
+            if not sent:
+                # Leave the requeued changes for the next flush
+                return
+            batch = self._take()
+
+    def _targets(self, index):
+        # While an index is rebuilt its changes are written to both
+        now = time.monotonic()
+        checked = self._rebuilding.get(index)
+        if checked is None or now - checked[0] >= self.rebuild_check_interval:
+            try:
+                rebuilding = bool(self.app.elasticsearch.indices.exists_alias(
+                    name=rebuild_alias(index)))
+            except (ApiError, TransportError):
+                rebuilding = checked[1] if checked else False
+            checked = self._rebuilding[index] = (now, rebuilding)
+        return [index, rebuild_alias(index)] if checked[1] else [index]
+
+    def _send(self, batch, max_retries=None):
+        operations = []
+        keys = []
+        for (index, id), (document, _) in batch.items():
+            for target in self._targets(index):
+                if document is None:
+                    operations.append({'delete': {'_index': target,
+                                                  '_id': id}})
+                else:
+                    operations.append({'index': {'_index': target,
+                                                 '_id': id}})
+                    operations.append(document)
+                keys.append((index, id))
+        if max_retries is None:
+            max_retries = self.max_retries
+        for attempt in range(max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = self.app.elasticsearch.bulk(operations=operations)
+            except (ApiError, TransportError):
+                self.app.metrics.incr('search.bulk_errors')
+                continue
+            self.app.metrics.incr('search.documents_indexed', len(batch))
+            failed = self._failed(batch, keys, response)
+            self._requeue(failed)
+            return not failed
+        self.app.logger.error('Bulk indexing failed for %d documents',
+                              len(batch))
+        self._requeue(batch)
+        return False
+
+    def _failed(self, batch, keys, response):
+        if not response.get('errors'):
+            return {}
+        failed = {}
+        # Items come back in request order, which maps writes to a concrete
+        # or rebuilding index back to the queued change
+        for key, item in zip(keys, response['items']):
+            action, result = next(iter(item.items()))
+            status = result.get('status', 200)
+            if status == 429 or status >= 500:
+                failed[key] = batch[key]
+            elif status >= 400 and not (action == 'delete' and status == 404):
+                self.app.logger.error('Could not index %s/%s: %s',
+                                      result['_index'], result['_id'],
+                                      result.get('error'))
+        return failed
+
+
+_started_queues = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_started_queues():
+    # Changes still queued at exit get a single attempt, so a search outage
+    # does not hold up shutdown with backoff sleeps
+    for queue in list(_started_queues):
+        queue.flush(max_retries=0)
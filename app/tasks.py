@@ -1,12 +1,17 @@
-import json
+import os
 import sys
 import time
+import uuid
 import sqlalchemy as sa
-from flask import render_template
+from flask import render_template, url_for
 from rq import get_current_job
 from app import create_app, db
-from app.models import User, Post, Task
+from app.models import User, Notification, Task
 from app.email import send_email
+from app.exports import ProgressThrottle, export_content_type, \
+    export_filename, post_chunks, sweep_exports, write_export
+from app.language import backfill_languages
+from app.translate import prefetch_translations
 
 app = create_app()
 app.app_context().push()
@@ -15,42 +20,90 @@ app.app_context().push()
 def _set_task_progress(progress):
     job = get_current_job()
     if job:
-        job.meta['progress'] = progress
-        job.save_meta()
-        task = db.session.get(Task, job.get_id())
-        task.user.add_notification('task_progress', {'task_id': job.get_id(),
-                                                     'progress': progress})
-        if progress >= 100:
-            task.complete = True
-        db.session.commit()
+        previous = app.task_progress.set(job.get_id(), progress)
+        data = {'task_id': job.get_id(), 'progress': progress}
+        if previous is None or (progress >= 100 > previous):
+            # Only starting and finishing are written to the database, the
+            # ticks in between live in the progress store
+            task = db.session.get(Task, job.get_id())
+            job.meta['user_id'] = task.user_id
+            task.user.add_notification('task_progress', data)
+            if progress >= 100:
+                task.complete = True
+            db.session.commit()
+        elif 'user_id' in job.meta:
+            # Moving the mark sends pollers to the live progress
+            app.notification_marks.advance(job.meta['user_id'], time.time())
+            app.broker.publish(Notification.channel(job.meta['user_id']),
+                               Notification.live_event('task_progress', data))
+
+
+def _export_url(filename, url_root):
+    # The worker has no request of its own, so the link is built against
+    # the root URL the export was requested from
+    with app.test_request_context(base_url=url_root):
+        return url_for('main.download_export', filename=filename,
+                       _external=True)
 
 
-def export_posts(user_id):
+def export_posts(user_id, url_root=None):
     try:
         user = db.session.get(User, user_id)
         _set_task_progress(0)
-        data = []
-        i = 0
+        config = app.config
+        job = get_current_job()
+        filename = export_filename(
+            job.get_id() if job else uuid.uuid4().hex,
+            config['EXPORT_FORMAT'], config['EXPORT_COMPRESS'])
+        os.makedirs(config['EXPORT_DIR'], exist_ok=True)
+        sweep_exports(config['EXPORT_DIR'], config['EXPORT_RETENTION'])
+        path = os.path.join(config['EXPORT_DIR'], filename)
         total_posts = db.session.scalar(sa.select(sa.func.count()).select_from(
             user.posts.select().subquery()))
-        for post in db.session.scalars(user.posts.select().order_by(
-                Post.timestamp.asc())):
-            data.append({'body': post.body,
-                         'timestamp': post.timestamp.isoformat() + 'Z'})
-            time.sleep(5)
-            i += 1
-            _set_task_progress(100 * i // total_posts)
+        write_export(
+            path, post_chunks(user, config['EXPORT_CHUNK_SIZE']),
+            config['EXPORT_FORMAT'], config['EXPORT_COMPRESS'],
+            total=total_posts, progress=ProgressThrottle(
+                _set_task_progress, config['EXPORT_PROGRESS_RATE']))
 
+        url = None
+        attachments = None
+        if os.path.getsize(path) > config['EXPORT_ATTACHMENT_MAX_SIZE']:
+            url = _export_url(filename, url_root)
+        else:
+            with open(path, 'rb') as f:
+                attachments = [(
+                    export_filename('posts', config['EXPORT_FORMAT'],
+                                    config['EXPORT_COMPRESS']),
+                    export_content_type(config['EXPORT_FORMAT'],
+                                        config['EXPORT_COMPRESS']),
+                    f.read())]
+            os.remove(path)
         send_email(
             '[Microblog] Your blog posts',
             sender=app.config['ADMINS'][0], recipients=[user.email],
-            text_body=render_template('email/export_posts.txt', user=user),
-            html_body=render_template('email/export_posts.html', user=user),
-            attachments=[('posts.json', 'application/json',
-                          json.dumps({'posts': data}, indent=4))],
-            sync=True)
+            text_body=render_template('email/export_posts.txt', user=user,
+                                      url=url),
+            html_body=render_template('email/export_posts.html', user=user,
+                                      url=url),
+            attachments=attachments, sync=True)
     except Exception:
         _set_task_progress(100)
         app.logger.error('Unhandled exception', exc_info=sys.exc_info())
     finally:
         _set_task_progress(100)
+
+
+def pretranslate_posts():
+    stats = prefetch_translations()
+    job = get_current_job()
+    if job:
+        job.meta.update(stats)
+        job.save_meta()
+    app.logger.info('Pre-translated %(translations)d texts in '
+                    '%(seconds).1fs', stats)
+
+
+def detect_post_languages(post_id=None):
+    count = backfill_languages(ids=[post_id] if post_id is not None else None)
+    app.logger.info('Detected the language of %d posts', count)
@@ -1,21 +1,179 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import hashlib
+import time
+import redis
+import sqlalchemy as sa
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
 from flask_babel import _
+from app.cache import LRUCache
 
+MAX_BATCH_SIZE = 100
 
-def translate(text, source_language, dest_language):
-    if 'MS_TRANSLATOR_KEY' not in current_app.config or \
-            not current_app.config['MS_TRANSLATOR_KEY']:
-        return _('Error: the translation service is not configured.')
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+
+class TranslationError(Exception):
+    pass
+
+
+def microsoft_translator(texts, source_language, dest_language):
     auth = {
         'Ocp-Apim-Subscription-Key': current_app.config['MS_TRANSLATOR_KEY'],
         'Ocp-Apim-Subscription-Region': 'westus'
     }
-    r = requests.post(
+    r = session.post(
         'https://api.cognitive.microsofttranslator.com'
         '/translate?api-version=3.0&from={}&to={}'.format(
-            source_language, dest_language), headers=auth, json=[
-                {'Text': text}])
+            source_language, dest_language), headers=auth,
+        json=[{'Text': text} for text in texts],
+        timeout=current_app.config['TRANSLATOR_TIMEOUT'])
     if r.status_code != 200:
-        return _('Error: the translation service failed.')
-    return r.json()[0]['translations'][0]['text']
+        raise TranslationError(
+            'translator returned status {}'.format(r.status_code))
+    return [item['translations'][0]['text'] for item in r.json()]
+
+
+def stub_translator(texts, source_language, dest_language):
+    return ['[{}] {}'.format(dest_language, text) for text in texts]
+
+
+translators = {
+    'microsoft': microsoft_translator,
+    'stub': stub_translator,
+}
+
+
+def cache_key(text, source_language, dest_language):
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return 'translation:{}:{}:{}'.format(source_language, dest_language,
+                                         digest)
+
+
+class LocalTranslationCache:
+    def __init__(self, maxsize=10000, ttl=604800):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self._cache.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self._cache.put(key, value)
+
+
+class RedisTranslationCache:
+    def __init__(self, connection, ttl=604800):
+        self.connection = connection
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        # Reads push the expiry forward, so the least recently used
+        # translations are the ones that expire
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for key in keys:
+                pipeline.getex(key, ex=self.ttl)
+            values = pipeline.execute()
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not read translations',
+                                       exc_info=True)
+            return {}
+        return {key: value.decode('utf-8')
+                for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping):
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipeline.set(key, value, ex=self.ttl)
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not store translations',
+                                       exc_info=True)
+
+
+def translate(text, source_language, dest_language):
+    return translate_many([text], source_language, dest_language)[0]
+
+
+def translate_many(texts, source_language, dest_language):
+    translator = current_app.config['TRANSLATOR']
+    if translator == 'microsoft' and \
+            not current_app.config.get('MS_TRANSLATOR_KEY'):
+        return [_('Error: the translation service is not configured.')] * \
+            len(texts)
+    cache = current_app.translation_cache
+    keys = [cache_key(text, source_language, dest_language)
+            for text in texts]
+    found = cache.get_many(keys)
+    missing = list(dict.fromkeys(
+        text for text, key in zip(texts, keys) if key not in found))
+    for start in range(0, len(missing), MAX_BATCH_SIZE):
+        batch = missing[start:start + MAX_BATCH_SIZE]
+        try:
+            translations = translators[translator](
+                batch, source_language, dest_language)
+        except (TranslationError, requests.RequestException):
+            current_app.logger.warning('Translation failed', exc_info=True)
+            error = _('Error: the translation service failed.')
+            return [found.get(key, error) for key in keys]
+        translated = {cache_key(text, source_language, dest_language): value
+                      for text, value in zip(batch, translations)}
+        cache.set_many(translated)
+        found.update(translated)
+    return [found[key] for key in keys]
+
+
+def cached_translations(posts, dest_language):
+    posts = [post for post in posts
+             if post.language and post.language != dest_language]
+    if not posts:
+        return {}
+    keys = [cache_key(post.body, post.language, dest_language)
+            for post in posts]
+    found = current_app.translation_cache.get_many(keys)
+    current_app.metrics.incr('translate.cache_hits', len(found))
+    current_app.metrics.incr('translate.cache_misses', len(keys) - len(found))
+    return {post.id: found[key] for post, key in zip(posts, keys)
+            if key in found}
+
+
+def prefetch_translations(hours=None, limit=None):
+    from app import db
+    from app.models import Post, User
+    config = current_app.config
+    since = datetime.now(timezone.utc) - timedelta(
+        hours=hours or config['TRANSLATION_PREFETCH_HOURS'])
+    # Posts by the most followed authors reach the most readers
+    posts = db.session.scalars(
+        sa.select(Post).join(Post.author)
+        .where(Post.timestamp >= since, Post.language != '')
+        .order_by(User.follower_count.desc(), Post.timestamp.desc())
+        .limit(limit or config['TRANSLATION_PREFETCH_LIMIT']))
+    texts = defaultdict(list)
+    for post in posts:
+        for language in config['LANGUAGES']:
+            if post.language != language:
+                texts[(post.language, language)].append(post.body)
+    start = time.perf_counter()
+    count = 0
+    for (source_language, dest_language), batch in texts.items():
+        translate_many(batch, source_language, dest_language)
+        count += len(batch)
+    elapsed = time.perf_counter() - start
+    # The prefetch runs in the RQ worker, so its metrics are shared with
+    # the web processes
+    current_app.metrics.incr('translate.prefetched', count, shared=True)
+    current_app.metrics.observe('translate.prefetch_seconds', elapsed,
+                                shared=True)
+    return {'translations': count, 'seconds': elapsed,
+            'per_second': count / elapsed if elapsed else 0.0}
@@ -0,0 +1,58 @@
+import threading
+import redis
+from flask import current_app
+
+
+class LocalWatermarks:
+    def __init__(self):
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return self._marks.get(user_id)
+
+    def advance(self, user_id, timestamp):
+        with self._lock:
+            self._marks[user_id] = max(timestamp,
+                                       self._marks.get(user_id, timestamp))
+
+    def seed(self, user_id, timestamp):
+        with self._lock:
+            self._marks.setdefault(user_id, timestamp)
+
+
+class RedisWatermarks:
+    def __init__(self, connection, key='notification-marks'):
+        self.connection = connection
+        self.key = key
+
+    def get(self, user_id):
+        try:
+            mark = self.connection.zscore(self.key, user_id)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not read notification marks',
+                                       exc_info=True)
+            return None
+        return float(mark) if mark is not None else None
+
+    def advance(self, user_id, timestamp):
+        # GT keeps concurrent writers from moving a mark backwards
+        try:
+            self.connection.zadd(self.key, {user_id: timestamp}, gt=True)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not store notification marks',
+                                       exc_info=True)
+            # A mark left behind would hide the new notification, so drop it
+            # and let the next poll read the database
+            try:
+                self.connection.zrem(self.key, user_id)
+            except redis.exceptions.RedisError:
+                pass
+
+    def seed(self, user_id, timestamp):
+        try:
+            self.connection.zadd(self.key, {user_id: timestamp}, nx=True)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not store notification marks',
+                                       exc_info=True)
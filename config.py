@@ -17,9 +17,64 @@ class Config:
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_OUTBOX_WORKERS = int(os.environ.get('MAIL_OUTBOX_WORKERS') or 2)
+    MAIL_OUTBOX_MAX_RETRIES = int(
+        os.environ.get('MAIL_OUTBOX_MAX_RETRIES') or 3)
     ADMINS = ['your-email@example.com']
     LANGUAGES = ['en', 'es']
     MS_TRANSLATOR_KEY = os.environ.get('MS_TRANSLATOR_KEY')
+    LANGUAGE_DETECTION_DEFERRED = \
+        os.environ.get('LANGUAGE_DETECTION_DEFERRED') is not None
+    LANGUAGE_CACHE_SIZE = int(os.environ.get('LANGUAGE_CACHE_SIZE') or 4096)
+    TRANSLATOR = os.environ.get('TRANSLATOR') or 'microsoft'
+    TRANSLATOR_TIMEOUT = float(os.environ.get('TRANSLATOR_TIMEOUT') or 10)
+    TRANSLATION_CACHE_SIZE = int(
+        os.environ.get('TRANSLATION_CACHE_SIZE') or 10000)
+    TRANSLATION_CACHE_TTL = int(
+        os.environ.get('TRANSLATION_CACHE_TTL') or 7 * 24 * 3600)
+    TRANSLATION_PREFETCH_HOURS = int(
+        os.environ.get('TRANSLATION_PREFETCH_HOURS') or 24)
+    TRANSLATION_PREFETCH_LIMIT = int(
+        os.environ.get('TRANSLATION_PREFETCH_LIMIT') or 200)
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'elasticsearch'
+    SEARCH_BATCH_SIZE = int(os.environ.get('SEARCH_BATCH_SIZE') or 500)
+    SEARCH_FLUSH_INTERVAL = float(
+        os.environ.get('SEARCH_FLUSH_INTERVAL') or 1.0)
+    SEARCH_REBUILD_CHECK_INTERVAL = float(
+        os.environ.get('SEARCH_REBUILD_CHECK_INTERVAL') or 10.0)
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
+    LAST_SEEN_GRANULARITY = int(os.environ.get('LAST_SEEN_GRANULARITY') or 60)
+    LAST_SEEN_FLUSH_INTERVAL = int(
+        os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 30)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or
+                                os.cpu_count() or 1)
+    PASSWORD_HASH_QUEUE_SIZE = int(
+        os.environ.get('PASSWORD_HASH_QUEUE_SIZE') or 16)
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT') or 5)
+    API_TOKENS_SIGNED = os.environ.get('API_TOKENS_SIGNED') is not None
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+    NOTIFICATIONS_SSE = os.environ.get('NOTIFICATIONS_SSE') is not None
+    NOTIFICATIONS_STREAM_TIMEOUT = int(
+        os.environ.get('NOTIFICATIONS_STREAM_TIMEOUT') or 300)
+    NOTIFICATIONS_STREAM_HEARTBEAT = 15
+    NOTIFICATIONS_TTL = int(os.environ.get('NOTIFICATIONS_TTL') or
+                            30 * 24 * 3600)
+    EXPORT_DIR = os.environ.get('EXPORT_DIR') or \
+        os.path.join(basedir, 'exports')
+    EXPORT_FORMAT = os.environ.get('EXPORT_FORMAT') or 'json'
+    EXPORT_COMPRESS = os.environ.get('EXPORT_COMPRESS') is not None
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 1000)
+    EXPORT_PROGRESS_RATE = float(os.environ.get('EXPORT_PROGRESS_RATE') or 1)
+    EXPORT_ATTACHMENT_MAX_SIZE = int(
+        os.environ.get('EXPORT_ATTACHMENT_MAX_SIZE') or 1024 * 1024)
+    EXPORT_RETENTION = int(os.environ.get('EXPORT_RETENTION') or 7 * 24 * 3600)
+    EXPORT_ACCEL_REDIRECT = os.environ.get('EXPORT_ACCEL_REDIRECT')
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE') is not None
     POSTS_PER_PAGE = 25
+    TIMELINE_PULL_THRESHOLD = int(
+        os.environ.get('TIMELINE_PULL_THRESHOLD') or 10000)
+    TIMELINE_PULL_MAX_SOURCES = int(
+        os.environ.get('TIMELINE_PULL_MAX_SOURCES') or 8)
@@ -1,6 +1,8 @@
 import pytest
 import os
+import socket
 import sys
+from contextlib import contextmanager
 from unittest.mock import patch, MagicMock
 
 # Add the project root to sys.path to fix imports
@@ -16,6 +18,7 @@ patch('rq.Queue', return_value=MagicMock()).start()
 
 # Now we can safely import
 import config
+import sqlalchemy as sa
 from app import create_app, db
 from app.models import User, Post
 
@@ -32,6 +35,7 @@ class TestConfig(config.Config):
     LANGUAGES = ['en']  # Simplify languages
     POSTS_PER_PAGE = 3  # Smaller pagination for faster tests
     ELASTICSEARCH_TIMEOUT = 0.01  # Fast timeout for search tests
+    SEARCH_REBUILD_CHECK_INTERVAL = 0  # Rebuilds start without waiting
 
 
 @pytest.fixture
@@ -109,3 +113,50 @@ def auth_client(client, test_user, app):
             'password': 'password'
         }, follow_redirects=True)
         return client
+
+
+@pytest.fixture
+def count_queries(app):
+    """Returns a context manager that records the SQL statements issued."""
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(db.engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute',
+                            before_cursor_execute)
+    return counter
+
+
+class MailSink:
+    """Local SMTP server that keeps the messages it receives."""
+    def __init__(self):
+        self.messages = []
+        self.connections = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.connections.add(session.peer)
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+
+@pytest.fixture
+def mail_sink():
+    """Runs a debugging SMTP sink on a free local port."""
+    from aiosmtpd.controller import Controller
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    sink = MailSink()
+    controller = Controller(sink, hostname='127.0.0.1', port=port)
+    controller.start()
+    sink.port = port
+    yield sink
+    controller.stop()
@@ -93,3 +93,98 @@ def test_revoke_token(client, test_user):
     response = client.get(f'/api/users/{test_user.id}',
                          headers={'Authorization': f'Bearer {token}'})
     assert response.status_code == 401  # Unauthorized
+
+
+def test_token_lookup_is_cached(client, test_user, app, count_queries):
+    """Test repeated API calls resolve the token without a user query."""
+    response = client.post('/api/tokens', auth=(test_user.username, 'password'))
+    token = json.loads(response.data)['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get(f'/api/users/{test_user.id}', headers=headers)  # warm up
+
+    with app.app_context():
+        db.session.expunge_all()
+    with count_queries() as statements:
+        response = client.get(f'/api/users/{test_user.id}', headers=headers)
+    assert response.status_code == 200
+    assert not [s for s in statements if 'user.token =' in s]
+
+
+def test_cached_token_is_invalidated(client, test_user, app):
+    """Test token and password changes are seen by the cached lookups."""
+    response = client.post('/api/tokens', auth=(test_user.username, 'password'))
+    token = json.loads(response.data)['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/users', headers=headers).status_code == 200
+    assert app.user_cache.get(('user', test_user.id)) is not None
+
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        user.set_password('new-password')
+        db.session.commit()
+    assert app.user_cache.get(('user', test_user.id)) is None
+
+    # Revoking the token drops the cached user, so the next call sees it
+    assert client.get('/api/users', headers=headers).status_code == 200
+    client.delete('/api/tokens', headers=headers)
+    assert client.get('/api/users', headers=headers).status_code == 401
+
+
+@pytest.fixture
+def signed_tokens(app):
+    """Issue signed API tokens for the duration of a test."""
+    app.config['API_TOKENS_SIGNED'] = True
+    yield
+    app.config['API_TOKENS_SIGNED'] = False
+
+
+def test_signed_token(client, test_user, app, signed_tokens, count_queries):
+    """Test signed tokens are verified without a database query."""
+    response = client.post('/api/tokens', auth=(test_user.username, 'password'))
+    token = json.loads(response.data)['token']
+    assert token.count('.') == 2
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get(f'/api/users/{test_user.id}', headers=headers)  # warm up
+
+    with app.app_context():
+        db.session.expunge_all()
+    with count_queries() as statements:
+        response = client.get(f'/api/users/{test_user.id}', headers=headers)
+    assert response.status_code == 200
+    assert not [s for s in statements if 'FROM user' in s]
+
+    # A forged signature is rejected
+    forged = token[:-2] + ('AA' if not token.endswith('AA') else 'BB')
+    response = client.get(f'/api/users/{test_user.id}',
+                          headers={'Authorization': f'Bearer {forged}'})
+    assert response.status_code == 401
+
+
+def test_signed_token_revocation(client, test_user, app, signed_tokens):
+    """Test revoking bumps the token version and rejects older tokens."""
+    response = client.post('/api/tokens', auth=(test_user.username, 'password'))
+    token = json.loads(response.data)['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/users', headers=headers).status_code == 200
+
+    assert client.delete('/api/tokens', headers=headers).status_code == 204
+    assert client.get('/api/users', headers=headers).status_code == 401
+
+    # Tokens issued after the revocation carry the new version
+    response = client.post('/api/tokens', auth=(test_user.username, 'password'))
+    token = json.loads(response.data)['token']
+    assert client.get('/api/users', headers={
+        'Authorization': f'Bearer {token}'}).status_code == 200
+
+
+def test_opaque_token_with_signed_tokens(client, test_user, app):
+    """Test opaque tokens keep working once signed tokens are enabled."""
+    response = client.post('/api/tokens', auth=(test_user.username, 'password'))
+    token = json.loads(response.data)['token']
+    app.config['API_TOKENS_SIGNED'] = True
+    try:
+        response = client.get('/api/users', headers={
+            'Authorization': f'Bearer {token}'})
+    finally:
+        app.config['API_TOKENS_SIGNED'] = False
+    assert response.status_code == 200
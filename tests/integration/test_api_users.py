@@ -281,3 +281,26 @@ def test_update_user_unauthorized_api(client, test_user, app):
                         },
                         data=json.dumps(update_data))
     assert response.status_code == 403  # Forbidden
+
+
+def test_get_users_api_query_count(client, test_user, app, count_queries):
+    """Test a page of users is serialized in a constant number of queries."""
+    response = client.post('/api/tokens', auth=(test_user.username, 'password'))
+    token = json.loads(response.data)['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    with app.app_context():
+        db.session.add_all([User(username=f'bulkuser{i}',
+                                 email=f'bulkuser{i}@example.com')
+                            for i in range(100)])
+        db.session.commit()
+
+    client.get('/api/users?per_page=5', headers=headers)  # warm up
+    with count_queries() as small_page:
+        response = client.get('/api/users?per_page=5', headers=headers)
+    assert len(json.loads(response.data)['items']) == 5
+
+    with count_queries() as full_page:
+        response = client.get('/api/users?per_page=100', headers=headers)
+    assert len(json.loads(response.data)['items']) == 100
+    assert len(full_page) == len(small_page)
@@ -0,0 +1,72 @@
+import pytest
+from app import db
+from app.models import Task, User
+
+
+@pytest.fixture
+def export_file(app, test_user, tmp_path):
+    """Writes a finished export for the test user."""
+    app.config['EXPORT_DIR'] = str(tmp_path)
+    with app.app_context():
+        db.session.add(Task(id='job-id', name='export_posts',
+                            user_id=test_user.id, complete=True))
+        db.session.commit()
+    (tmp_path / 'job-id.json').write_bytes(b'{"posts": []}\n')
+    return 'job-id.json'
+
+
+def test_download_export(auth_client, export_file):
+    """Test the owner can download their export."""
+    response = auth_client.get('/exports/' + export_file)
+    assert response.status_code == 200
+    assert response.data == b'{"posts": []}\n'
+    assert response.headers['Content-Disposition'] == \
+        'attachment; filename=job-id.json'
+    assert 'private' in response.headers['Cache-Control']
+    assert response.headers['ETag']
+
+
+def test_download_export_range(auth_client, export_file):
+    """Test a partial download resumes from a byte offset."""
+    response = auth_client.get('/exports/' + export_file,
+                               headers={'Range': 'bytes=2-6'})
+    assert response.status_code == 206
+    assert response.data == b'posts'
+    assert response.headers['Content-Range'] == 'bytes 2-6/14'
+
+
+def test_download_export_not_modified(auth_client, export_file):
+    """Test a matching ETag skips the download."""
+    etag = auth_client.get('/exports/' + export_file).headers['ETag']
+    response = auth_client.get('/exports/' + export_file,
+                               headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_download_export_other_user(client, app, export_file):
+    """Test exports are only served to the user who requested them."""
+    with app.app_context():
+        user = User(username='other', email='other@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+    client.post('/auth/login', data={'username': 'other',
+                                     'password': 'password'})
+    assert client.get('/exports/' + export_file).status_code == 404
+
+
+def test_download_export_missing(auth_client, export_file, tmp_path):
+    """Test swept exports are no longer found."""
+    (tmp_path / export_file).unlink()
+    assert auth_client.get('/exports/' + export_file).status_code == 404
+
+
+def test_download_export_accel_redirect(auth_client, app, export_file):
+    """Test nginx is asked to serve the file when configured."""
+    app.config['EXPORT_ACCEL_REDIRECT'] = '/protected-exports/'
+    response = auth_client.get('/exports/' + export_file)
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == \
+        '/protected-exports/job-id.json'
@@ -93,3 +93,119 @@ def test_notification_reset_on_reading(auth_client, test_user, ensure_recipient)
     # Check homepage loads after reading messages
     response = auth_client.get('/')
     assert response.status_code == 200
+
+
+def test_notification_stream(auth_client, app, test_user):
+    """Test the event stream replays notifications since the last event."""
+    app.config['NOTIFICATIONS_STREAM_TIMEOUT'] = 0
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        user.add_notification('unread_message_count', 3)
+        db.session.commit()
+
+    response = auth_client.get('/notifications/stream')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert '"name": "unread_message_count"' in body
+    assert '"data": 3' in body
+
+    # Reconnecting with the last event id skips what was already delivered
+    last_event_id = body.split('\n')[0][len('id: '):]
+    response = auth_client.get('/notifications/stream',
+                               headers={'Last-Event-ID': last_event_id})
+    assert 'unread_message_count' not in response.get_data(as_text=True)
+
+
+def test_notification_stream_redis_error(auth_client, app):
+    """Test Redis read errors leave the stream paced by its heartbeat."""
+    from unittest.mock import MagicMock
+    import redis
+    from app.pubsub import RedisBroker
+    connection = MagicMock()
+    connection.pubsub.return_value.get_message.side_effect = \
+        redis.exceptions.ConnectionError()
+    broker = app.broker
+    app.broker = RedisBroker(connection)
+    app.config['NOTIFICATIONS_STREAM_TIMEOUT'] = 0.3
+    app.config['NOTIFICATIONS_STREAM_HEARTBEAT'] = 0.1
+    try:
+        response = auth_client.get('/notifications/stream')
+        body = response.get_data(as_text=True)
+    finally:
+        app.broker = broker
+    assert response.status_code == 200
+    assert 1 <= body.count(': keep-alive') <= 4
+    connection.pubsub.return_value.close.assert_called_once()
+
+
+def test_unread_counter(auth_client, app, test_user, ensure_recipient):
+    """Test the unread counter follows new messages and reading them."""
+    auth_client.post('/send_message/recipient',
+                     data={'message': 'first'})
+    auth_client.post('/send_message/recipient',
+                     data={'message': 'second'})
+    db.session.expire_all()
+    recipient = db.session.get(User, ensure_recipient.id)
+    assert recipient.unread_messages == 2
+    notification = db.session.scalar(recipient.notifications.select())
+    assert notification.get_data() == 2
+
+    # Reading the messages resets the counter
+    db.session.add(Message(sender_id=ensure_recipient.id,
+                           recipient_id=test_user.id, body='reply'))
+    db.session.commit()
+    db.session.expire_all()
+    assert db.session.get(User, test_user.id).unread_messages == 1
+    auth_client.get('/messages')
+    db.session.expire_all()
+    assert db.session.get(User, test_user.id).unread_message_count() == 0
+
+
+def test_notifications_poll(auth_client, app, test_user):
+    """Test polling returns the stored payloads as JSON."""
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        user.add_notification('unread_message_count', 3)
+        db.session.commit()
+
+    response = auth_client.get('/notifications')
+    assert response.mimetype == 'application/json'
+    notifications = response.json
+    assert [(n['name'], n['data']) for n in notifications] == \
+        [('unread_message_count', 3)]
+
+    since = notifications[0]['timestamp']
+    assert auth_client.get(f'/notifications?since={since}').json == []
+
+
+def test_notifications_poll_from_mark(auth_client, app, test_user,
+                                      count_queries):
+    """Test idle polls are answered from the mark without the database."""
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        user.add_notification('unread_message_count', 3)
+        db.session.commit()
+    response = auth_client.get('/notifications')
+    since = response.json[-1]['timestamp']
+    etag = response.headers['ETag']
+    assert etag == '"{}"'.format(since)
+
+    with count_queries() as statements:
+        response = auth_client.get(f'/notifications?since={since}')
+        assert response.json == []
+        response = auth_client.get(f'/notifications?since={since}',
+                                   headers={'If-None-Match': etag})
+        assert response.status_code == 304
+    assert not [s for s in statements if 'notification' in s]
+
+    # A new notification moves the mark and is delivered
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        user.add_notification('unread_message_count', 4)
+        db.session.commit()
+    response = auth_client.get(f'/notifications?since={since}',
+                               headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [n['data'] for n in response.json] == [4]
+    assert response.headers['ETag'] != etag
@@ -88,3 +88,184 @@ def test_post_pagination(auth_client, test_user, app):
     response = auth_client.get('/explore?page=1')
     assert response.status_code == 200
     assert b'Test pagination post' in response.data
+
+
+def test_explore_cursor_pagination(auth_client, test_user, app):
+    """Test that explore pages are linked with opaque cursors."""
+    from datetime import datetime, timezone, timedelta
+    from app.pagination import encode_cursor
+    now = datetime.now(timezone.utc)
+    with app.app_context():
+        posts = [Post(body=f"Cursor post {i}", author=test_user,
+                      timestamp=now + timedelta(seconds=i)) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        cursor = encode_cursor(posts[2].timestamp, posts[2].id)
+
+    response = auth_client.get('/explore')
+    assert b'Cursor post 4' in response.data
+    assert b'Cursor post 1' not in response.data
+    assert f'/explore?before={cursor}'.encode() in response.data
+    assert b'page=' not in response.data
+
+    response = auth_client.get(f'/explore?before={cursor}')
+    assert b'Cursor post 1' in response.data
+    assert b'Cursor post 0' in response.data
+    assert b'Cursor post 2' not in response.data
+
+
+@pytest.mark.parametrize('url', ['/', '/explore', '/user/testuser'])
+def test_post_listing_query_count(auth_client, test_user, app, count_queries,
+                                  url):
+    """Test a page of 25 posts renders in a constant number of queries."""
+    from app.models import User
+    app.config['POSTS_PER_PAGE'] = 25
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        db.session.add_all([Post(body=f"Single author post {i}", author=user)
+                            for i in range(25)])
+        db.session.commit()
+    auth_client.get(url)  # warm up the session before counting
+    with count_queries() as single_author:
+        assert auth_client.get(url).status_code == 200
+
+    # Following 25 distinct authors must not add a query per author
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        for i in range(25):
+            author = User(username=f'author{i}', email=f'author{i}@example.com')
+            db.session.add(author)
+            user.follow(author)
+            db.session.add(Post(body=f"Many authors post {i}", author=author))
+        db.session.commit()
+    auth_client.get(url)
+    with count_queries() as many_authors:
+        response = auth_client.get(url)
+    assert response.status_code == 200
+    assert len(many_authors) == len(single_author)
+
+
+def test_translate_route(auth_client, app):
+    """Test single and batch translation through the stub translator."""
+    app.config['TRANSLATOR'] = 'stub'
+    response = auth_client.post('/translate', json={
+        'text': 'Hello', 'source_language': 'en', 'dest_language': 'es'})
+    assert response.get_json() == {'text': '[es] Hello'}
+
+    response = auth_client.post('/translate', json={
+        'texts': ['Hello', 'Bye'], 'source_language': 'en',
+        'dest_language': 'es'})
+    assert response.get_json() == {'texts': ['[es] Hello', '[es] Bye']}
+
+    response = auth_client.post('/translate', json={
+        'texts': 'Hello', 'source_language': 'en', 'dest_language': 'es'})
+    assert response.status_code == 400
+
+
+def test_pretranslated_posts_are_embedded(auth_client, test_user, app):
+    """Test prefetched translations are rendered without a click."""
+    app.config['TRANSLATOR'] = 'stub'
+    with app.app_context():
+        db.session.add_all([
+            Post(body='hola mundo', author=test_user, language='es'),
+            Post(body='adios mundo', author=test_user, language='es'),
+        ])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['translate', 'prefetch'])
+    assert result.exit_code == 0
+    assert result.output.startswith('2 translations in')
+
+    # A post written after the prefetch still offers the translate link
+    with app.app_context():
+        db.session.add(Post(body='buenas noches', author=test_user,
+                            language='es'))
+        db.session.commit()
+
+    response = auth_client.get('/explore',
+                               headers={'Accept-Language': 'en'})
+    assert b'[en] hola mundo' in response.data
+    assert b'[en] adios mundo' in response.data
+    assert b'[en] buenas noches' not in response.data
+    assert response.data.count(b"'translation") == 1
+    metrics = app.metrics.snapshot()
+    assert metrics['translate.prefetched'] == 2
+    assert metrics['translate.cache_hits'] == 2
+    assert metrics['translate.cache_misses'] == 1
+
+
+def test_deferred_language_detection(auth_client, app):
+    """Test unclear posts are saved without a language and queued."""
+    app.config['LANGUAGE_DETECTION_DEFERRED'] = True
+    app.task_queue.reset_mock()
+    try:
+        auth_client.post('/', data={'post': 'Привет, как дела?'})
+        auth_client.post('/', data={'post': 'the cat is on the table and '
+                                            'it is happy'})
+    finally:
+        app.config['LANGUAGE_DETECTION_DEFERRED'] = False
+    with app.app_context():
+        languages = db.session.scalars(
+            db.select(Post.language).order_by(Post.id)).all()
+        post_id = db.session.scalar(
+            db.select(Post.id).where(Post.language.is_(None)))
+    assert languages == [None, 'en']
+    app.task_queue.enqueue.assert_called_once_with(
+        'app.tasks.detect_post_languages', post_id)
+
+
+def test_tasks_in_progress(auth_client, app, test_user):
+    """Test running tasks show their live progress."""
+    from app.models import Task
+    with app.app_context():
+        db.session.add(Task(id='running', name='export_posts',
+                            description='Exporting posts...',
+                            user_id=test_user.id))
+        db.session.add(Task(id='done', name='export_posts',
+                            description='Finished export',
+                            user_id=test_user.id, complete=True))
+        db.session.commit()
+    app.task_progress.set('running', 42)
+
+    response = auth_client.get('/')
+    assert b'Exporting posts...' in response.data
+    assert b'<span id="running-progress">42</span>%' in response.data
+    assert b'Finished export' not in response.data
+
+    notifications = auth_client.get('/notifications').json
+    assert {'name': 'task_progress',
+            'data': {'task_id': 'running', 'progress': 42}} in notifications
+
+
+def test_navbar_uses_one_query(auth_client, app, test_user, count_queries):
+    """Test the navbar and profile page share one task query."""
+    from app.models import Task
+    with app.app_context():
+        db.session.add(Task(id='running', name='export_posts',
+                            description='Exporting posts...',
+                            user_id=test_user.id))
+        db.session.commit()
+    auth_client.get('/user/testuser')  # warm up
+
+    with count_queries() as statements:
+        response = auth_client.get('/user/testuser')
+    assert response.status_code == 200
+    # The running export hides the export link on the profile page
+    assert b'Export your posts' not in response.data
+    assert b'Exporting posts...' in response.data
+    task_queries = [s for s in statements if 'FROM task' in s or
+                    'JOIN task' in s]
+    message_queries = [s for s in statements if 'FROM message' in s]
+    assert len(task_queries) == 1
+    # The unread count is read from the user row
+    assert message_queries == []
+
+
+def test_export_posts_passes_url_root(auth_client, app, test_user):
+    """Test the export job gets the root URL for its download link."""
+    app.task_queue.reset_mock()
+    app.task_queue.enqueue.return_value.get_id.return_value = 'export-id'
+    auth_client.get('/export_posts')
+    app.task_queue.enqueue.assert_called_once_with(
+        'app.tasks.export_posts', test_user.id,
+        url_root='http://{}/'.format(app.config['SERVER_NAME']))
@@ -65,3 +65,96 @@ def test_search_pagination(auth_client, app, mock_elasticsearch):
     
     # Verify next page link exists (since total > page size)
     assert b'?q=test&amp;page=2' in response.data
+
+
+@pytest.fixture
+def fts5_app(app):
+    """The application with the SQLite FTS5 search backend enabled."""
+    app.config['SEARCH_BACKEND'] = 'fts5'
+    yield app
+    app.config['SEARCH_BACKEND'] = 'elasticsearch'
+
+
+def test_fts5_search_backend(fts5_app, test_user):
+    """Test posts are indexed on commit and ranked with BM25."""
+    with fts5_app.app_context():
+        once = Post(body='flask makes web apps easy', author=test_user)
+        twice = Post(body='flask, flask and more flask', author=test_user)
+        other = Post(body='nothing to see here', author=test_user)
+        db.session.add_all([once, twice, other])
+        db.session.commit()
+
+        posts, total = Post.search('Flask', 1, 10)
+        assert total == 2
+        assert list(posts) == [twice, once]
+
+        # Edits and deletes are reflected as soon as they are committed
+        other.body = 'flask after all'
+        db.session.delete(twice)
+        db.session.commit()
+        posts, total = Post.search('flask', 1, 10)
+        assert total == 2
+        assert set(posts) == {once, other}
+
+        # Query syntax characters in user input are treated as text
+        posts, total = Post.search('flask" OR (', 1, 10)
+        assert total == 2
+        assert Post.search('!!', 1, 10) == ([], 0)
+
+
+def test_fts5_search_rollback(fts5_app, test_user):
+    """Test index changes are discarded with the transaction."""
+    with fts5_app.app_context():
+        db.session.add(Post(body='rolled back post', author=test_user))
+        db.session.flush()
+        db.session.rollback()
+        assert Post.search('rolled', 1, 10) == ([], 0)
+
+
+def test_fts5_search_route(auth_client, fts5_app, test_user):
+    """Test the search page is served from the FTS5 index."""
+    with fts5_app.app_context():
+        db.session.add(Post(body='searchable words', author=test_user))
+        db.session.commit()
+    response = auth_client.get('/search?q=searchable')
+    assert response.status_code == 200
+    assert b'searchable words' in response.data
+
+
+def test_fts5_requires_sqlite(fts5_app):
+    """Test FTS5 is never selected for databases other than SQLite."""
+    from unittest.mock import patch
+    from app.search import search_backend
+    with fts5_app.app_context():
+        assert search_backend() is not None
+        with patch.object(db.engine.dialect, 'name', 'postgresql'):
+            assert search_backend() is None
+
+
+def test_fts5_reindex(fts5_app, test_user):
+    """Test reindex rebuilds the FTS5 index from the post table."""
+    with fts5_app.app_context():
+        db.session.add_all([Post(body=f'post number {i}', author=test_user)
+                            for i in range(3)])
+        db.session.commit()
+        db.session.execute(db.text('DELETE FROM post_search'))
+        db.session.commit()
+        assert Post.search('number', 1, 10) == ([], 0)
+
+        result = fts5_app.test_cli_runner().invoke(
+            args=['search', 'reindex', '--chunk-size', '2'])
+        assert result.exit_code == 0
+        assert 'post is now served by post_search' in result.output
+        assert Post.search('number', 1, 10)[1] == 3
+
+        # Resuming keeps the rows indexed before the restart point
+        first = db.session.scalar(db.select(db.func.min(Post.id)))
+        result = fts5_app.test_cli_runner().invoke(
+            args=['search', 'reindex', '--start-after', str(first)])
+        assert result.exit_code == 0
+        assert Post.search('number', 1, 10)[1] == 3
+
+        result = fts5_app.test_cli_runner().invoke(
+            args=['search', 'benchmark', '--runs', '3', 'number'])
+        assert result.exit_code == 0
+        assert 'fts5' in result.output
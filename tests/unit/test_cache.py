@@ -0,0 +1,96 @@
+from unittest.mock import MagicMock, patch
+import redis
+from flask import g
+from app.cache import LRUCache, request_cached
+from app.pubsub import LocalBroker
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Test the cache keeps at most maxsize entries."""
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_entries_expire():
+    """Test entries are dropped once their TTL has passed."""
+    cache = LRUCache(ttl=10)
+    with patch('app.cache.time.monotonic', return_value=100):
+        cache.put('a', 1)
+    with patch('app.cache.time.monotonic', return_value=105):
+        assert cache.get('a') == 1
+    with patch('app.cache.time.monotonic', return_value=111):
+        assert cache.get('a') is None
+
+
+def test_disabled_cache():
+    """Test a zero TTL turns the cache off."""
+    cache = LRUCache(ttl=0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+
+def test_invalidation_reaches_other_workers():
+    """Test invalidated keys are dropped by every cache on the channel."""
+    broker = LocalBroker()
+    worker1 = LRUCache(broker=broker, channel='cache')
+    worker2 = LRUCache(broker=broker, channel='cache')
+    for cache in worker1, worker2:
+        cache.get(('user', 1))  # subscribes on first use
+        cache.put(('user', 1), 'john')
+        cache.put(('user', 2), 'susan')
+
+    worker1.invalidate([('user', 1)])
+    assert worker1.get(('user', 1)) is None
+    assert worker2.get(('user', 1)) is None
+    assert worker2.get(('user', 2)) == 'susan'
+
+    # Malformed messages are ignored
+    broker.publish('cache', 'not json')
+    assert worker2.get(('user', 2)) == 'susan'
+
+
+def test_unreachable_broker_falls_back_to_ttl(app):
+    """Test a failing subscription leaves the cache working on TTL alone."""
+    broker = MagicMock()
+    broker.subscribe.side_effect = redis.exceptions.ConnectionError()
+    cache = LRUCache(ttl=10, broker=broker, channel='cache',
+                     resubscribe=30)
+    with patch('app.cache.time.monotonic', return_value=100):
+        cache.put('a', 1)
+        assert cache.get('a') == 1
+        assert cache.get('a') == 1
+    assert broker.subscribe.call_count == 1
+
+    # The subscription is retried once the back off has passed
+    broker.subscribe.side_effect = None
+    with patch('app.cache.time.monotonic', return_value=131):
+        assert cache.get('a') is None  # expired
+    assert broker.subscribe.call_count == 2
+    cache.get('a')
+    broker.subscribe.return_value.get.assert_called_with(timeout=0)
+
+
+def test_request_cached(app):
+    """Test values are computed once per request and per user."""
+    calls = []
+
+    class Owner:
+        def __init__(self, id):
+            self.id = id
+
+        @request_cached
+        def value(self, arg):
+            calls.append((self.id, arg))
+            return len(calls)
+
+    with app.test_request_context():
+        g.request_cache = {}
+        assert Owner(1).value('a') == Owner(1).value('a') == 1
+        assert Owner(2).value('a') == 2
+        assert Owner(1).value('b') == 3
+    assert len(calls) == 3
@@ -163,3 +163,124 @@ def test_compile_command_failure(mock_os_system, runner):
     # RuntimeError is caught but not displayed in output
     assert isinstance(result.exception, RuntimeError)
     assert 'compile command failed' in str(result.exception)
+
+
+def test_timeline_rebuild_command(app):
+    """Test the timeline rebuild command restores home timelines"""
+    from app import db
+    from app.models import User, Post, Timeline
+    u1 = User(username='john', email='john@example.com')
+    u2 = User(username='susan', email='susan@example.com')
+    db.session.add_all([u1, u2])
+    db.session.commit()
+    u1.follow(u2)
+    post = Post(body='post from susan', author=u2)
+    db.session.add(post)
+    db.session.commit()
+
+    # Wipe the materialized timelines and rebuild them from scratch
+    db.session.execute(db.delete(Timeline))
+    db.session.commit()
+    assert db.session.scalars(u1.following_posts()).all() == []
+
+    result = app.test_cli_runner().invoke(args=['timeline', 'rebuild'])
+    assert result.exit_code == 0
+    assert db.session.scalars(u1.following_posts()).all() == [post]
+    assert db.session.scalars(u2.following_posts()).all() == [post]
+
+
+def test_counters_reconcile_command(app):
+    """Test the counters reconcile command recomputes user counters"""
+    from app import db
+    from app.models import User, Post, Message
+    u1 = User(username='john', email='john@example.com')
+    u2 = User(username='susan', email='susan@example.com')
+    db.session.add_all([u1, u2])
+    db.session.commit()
+    u1.follow(u2)
+    db.session.add(Post(body='post from susan', author=u2))
+    db.session.add(Message(author=u1, recipient=u2, body='hi susan'))
+    db.session.commit()
+
+    # Simulate counters that drifted from the underlying tables
+    db.session.execute(db.update(User).values(
+        post_count=7, follower_count=7, followed_count=7, unread_messages=7))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['counters', 'reconcile'])
+    assert result.exit_code == 0
+    assert (u1.post_count, u1.follower_count, u1.followed_count) == (0, 0, 1)
+    assert (u2.post_count, u2.follower_count, u2.followed_count) == (1, 1, 0)
+    assert (u1.unread_messages, u2.unread_messages) == (0, 1)
+
+
+def test_search_reindex_command(app):
+    """Test the search reindex command streams posts in id order chunks"""
+    from unittest.mock import MagicMock
+    from app import db
+    from app.models import User, Post
+    user = User(username='john', email='john@example.com')
+    db.session.add(user)
+    db.session.add_all([Post(body=f'post {i}', author=user)
+                        for i in range(5)])
+    db.session.commit()
+    last = db.session.scalar(db.select(db.func.max(Post.id)))
+
+    app.elasticsearch = MagicMock()
+    app.elasticsearch.bulk.return_value = {'errors': False, 'items': []}
+    app.elasticsearch.indices.exists.return_value = False
+    app.elasticsearch.indices.exists_alias.return_value = False
+    try:
+        result = app.test_cli_runner().invoke(args=[
+            'search', 'reindex', '--chunk-size', '2', '--workers', '2',
+            '--index', 'post-partial', '--start-after', str(last - 4)])
+    finally:
+        app.elasticsearch = None
+    assert result.exit_code == 0
+    # The first post is skipped and the remaining four go out in two chunks
+    assert 'post is now served by post-partial' in result.output
+    assert f'4 documents, last id {last}' in result.output
+
+    # Resuming without the index being built would swap in a partial one
+    es = app.elasticsearch = MagicMock()
+    try:
+        result = app.test_cli_runner().invoke(args=[
+            'search', 'reindex', '--start-after', str(last - 4)])
+    finally:
+        app.elasticsearch = None
+    assert result.exit_code != 0
+    assert 'needs the index being built' in result.output
+    es.indices.create.assert_not_called()
+
+
+def test_exports_sweep_command(app, tmp_path):
+    """Test the sweep command removes expired exports."""
+    app.config['EXPORT_DIR'] = str(tmp_path)
+    expired = tmp_path / 'expired.json'
+    expired.write_text('{}')
+    os.utime(expired, (0, 0))
+    (tmp_path / 'recent.json').write_text('{}')
+
+    result = app.test_cli_runner().invoke(args=['exports', 'sweep'])
+
+    assert result.exit_code == 0
+    assert 'Removed 1 exports' in result.output
+    assert os.listdir(tmp_path) == ['recent.json']
+
+
+def test_notifications_sweep_command(app):
+    """Test the sweep command removes expired notifications."""
+    from app import db
+    from app.models import User, Notification
+    user = User(username='john', email='john@example.com')
+    db.session.add(user)
+    db.session.commit()
+    Notification.upsert(user.id, 'expired', '0', 0.0)
+    user.add_notification('recent', 0)
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(
+        args=['notifications', 'sweep', '--batch-size', '1'])
+
+    assert result.exit_code == 0
+    assert 'Removed 1 notifications' in result.output
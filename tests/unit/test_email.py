@@ -2,7 +2,7 @@ import unittest
 from unittest.mock import patch, MagicMock, call
 from flask import Flask
 from flask_mail import Message
-from app.email import send_email, send_async_email
+from app.email import send_email
 
 
 class EmailTestCase(unittest.TestCase):
@@ -15,18 +15,6 @@ class EmailTestCase(unittest.TestCase):
     def tearDown(self):
         self.app_context.pop()
 
-    @patch('app.email.mail')
-    def test_send_async_email(self, mock_mail):
-        """Test the async email helper function"""
-        # Create mock message
-        msg = MagicMock()
-        
-        # Call function
-        send_async_email(self.app, msg)
-        
-        # Verify
-        mock_mail.send.assert_called_once_with(msg)
-
     @patch('app.email.mail')
     def test_send_email_sync(self, mock_mail):
         """Test synchronous email sending"""
@@ -49,9 +37,10 @@ class EmailTestCase(unittest.TestCase):
         self.assertEqual(msg.body, 'Test text')
         self.assertEqual(msg.html, '<p>Test HTML</p>')
 
-    @patch('app.email.Thread')
-    def test_send_email_async(self, mock_thread):
-        """Test asynchronous email sending"""
+    def test_send_email_async(self):
+        """Test asynchronous email sending goes through the outbox"""
+        self.app.outbox = MagicMock()
+
         # Call function with default sync=False
         send_email(
             subject='Test Subject',
@@ -60,16 +49,11 @@ class EmailTestCase(unittest.TestCase):
             text_body='Test text',
             html_body='<p>Test HTML</p>'
         )
-        
-        # Verify thread was started
-        mock_thread.assert_called_once()
-        thread_call = mock_thread.call_args
-        self.assertEqual(thread_call[1]['target'], send_async_email)
-        
-        # Verify message parameters - we can only check that args[1] is a Message object
-        # since we can't easily mock Flask's current_app._get_current_object()
-        self.assertIsInstance(thread_call[1]['args'][1], Message)
-        msg = thread_call[1]['args'][1]
+
+        # Verify the message was queued instead of sent
+        self.app.outbox.put.assert_called_once()
+        msg = self.app.outbox.put.call_args[0][0]
+        self.assertIsInstance(msg, Message)
         self.assertEqual(msg.subject, 'Test Subject')
         self.assertEqual(msg.sender, 'test@example.com')
         self.assertEqual(msg.recipients, ['recipient@example.com'])
@@ -0,0 +1,83 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from app import db
+from app.exports import ProgressThrottle, post_chunks, sweep_exports, \
+    write_export
+from app.models import Post
+
+
+def add_posts(user, count):
+    # Pairs of posts share a timestamp so the keyset has to break ties
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    posts = [Post(body='post {}'.format(i), author=user,
+                  timestamp=start + timedelta(minutes=i // 2))
+             for i in range(count)]
+    db.session.add_all(posts)
+    db.session.commit()
+    return posts
+
+
+def test_post_chunks(app, test_user):
+    """Test keyset chunks cover every post exactly once and in order"""
+    posts = add_posts(test_user, 7)
+
+    chunks = list(post_chunks(test_user, chunk_size=2))
+
+    assert [len(rows) for rows in chunks] == [2, 2, 2, 1]
+    assert [row.id for rows in chunks for row in rows] == \
+        [post.id for post in posts]
+
+
+def test_write_export_json(app, test_user, tmp_path):
+    """Test the streamed JSON document matches the post list"""
+    add_posts(test_user, 5)
+    path = str(tmp_path / 'export.json')
+    progress = []
+
+    count = write_export(path, post_chunks(test_user, chunk_size=2),
+                         total=5, progress=progress.append)
+
+    assert count == 5
+    with open(path) as f:
+        data = json.load(f)
+    assert [post['body'] for post in data['posts']] == \
+        ['post {}'.format(i) for i in range(5)]
+    assert progress == [40, 80, 100]
+    assert not (tmp_path / 'export.json.part').exists()
+
+
+def test_write_export_empty(app, test_user, tmp_path):
+    """Test an export with no posts is still valid JSON"""
+    path = str(tmp_path / 'export.json')
+
+    assert write_export(path, post_chunks(test_user)) == 0
+    with open(path) as f:
+        assert json.load(f) == {'posts': []}
+
+
+def test_progress_throttle():
+    """Test progress updates are dropped when they come too quickly"""
+    updates = []
+    throttle = ProgressThrottle(updates.append, rate=2)
+    with patch('app.exports.time.monotonic') as monotonic:
+        for now, progress in [(0, 10), (0.2, 20), (0.5, 30), (0.9, 40)]:
+            monotonic.return_value = now
+            throttle(progress)
+    assert updates == [10, 30]
+
+
+def test_sweep_exports(tmp_path):
+    """Test exports past the retention period are deleted"""
+    old = tmp_path / 'old.json'
+    new = tmp_path / 'new.json'
+    old.write_text('{}')
+    new.write_text('{}')
+    os.utime(old, (time.time() - 100, time.time() - 100))
+
+    assert sweep_exports(str(tmp_path), max_age=60) == 1
+    assert not old.exists()
+    assert new.exists()
+    assert sweep_exports(str(tmp_path / 'missing'), max_age=60) == 0
@@ -0,0 +1,89 @@
+from unittest.mock import patch
+from app import db
+from app.language import LanguageDetector, backfill_languages, \
+    script_language, stop_word_language
+from app.models import User, Post
+
+
+def test_script_language():
+    """Test scripts used by a single language are classified directly."""
+    assert script_language('こんにちは世界') == 'ja'
+    assert script_language('안녕하세요 여러분') == 'ko'
+    assert script_language('Καλημέρα σε όλους') == 'el'
+    # Latin, Cyrillic and Han are shared by many languages
+    assert script_language('hello world') is None
+    assert script_language('привет мир') is None
+    assert script_language('1234 !!') is None
+
+
+def test_stop_word_language():
+    """Test clear stop word majorities are classified directly."""
+    assert stop_word_language('the cat is on the table and it is happy') \
+        == 'en'
+    assert stop_word_language('el perro de la casa es muy grande y está '
+                              'feliz') == 'es'
+    assert stop_word_language('der Hund ist nicht mit dem Ball') == 'de'
+    assert stop_word_language('hello world') is None
+
+
+def test_detection_is_memoized(app):
+    """Test each body is only given to langdetect once."""
+    detector = LanguageDetector()
+    with patch.object(detector, '_langdetect',
+                      return_value='ru') as mock_langdetect:
+        assert detector.detect('привет мир') == 'ru'
+        assert detector.detect('привет мир') == 'ru'
+    mock_langdetect.assert_called_once()
+
+
+def test_langdetect_fallback_is_deterministic(app):
+    """Test the fallback gives the same answer every time."""
+    detector = LanguageDetector()
+    text = 'Привет, как у тебя дела сегодня?'
+    results = {LanguageDetector()._langdetect(text) for _ in range(5)}
+    assert results == {detector.detect(text)}
+    assert detector.detect('12345') == ''
+
+
+def test_backfill_languages(app):
+    """Test posts saved without a language are detected in batches."""
+    user = User(username='john', email='john@example.com')
+    db.session.add_all([
+        Post(body='the cat is on the table and it is happy', author=user),
+        Post(body='こんにちは世界', author=user),
+        Post(body='already known', author=user, language='en'),
+    ])
+    db.session.commit()
+
+    assert backfill_languages(batch_size=1) == 2
+    languages = db.session.scalars(
+        db.select(Post.language).order_by(Post.id)).all()
+    assert languages == ['en', 'ja', 'en']
+    assert backfill_languages() == 0
+
+
+def test_backfill_single_post(app):
+    """Test a backfill limited to some posts leaves the others alone."""
+    user = User(username='john', email='john@example.com')
+    posts = [Post(body='the cat is on the table and it is happy',
+                  author=user),
+             Post(body='こんにちは世界', author=user)]
+    db.session.add_all(posts)
+    db.session.commit()
+
+    assert backfill_languages(ids=[posts[1].id]) == 1
+    languages = db.session.scalars(
+        db.select(Post.language).order_by(Post.id)).all()
+    assert languages == [None, 'ja']
+
+
+def test_language_benchmark_command(app, tmp_path):
+    """Test the benchmark reports throughput for a sample corpus."""
+    corpus = tmp_path / 'posts.txt'
+    corpus.write_text('the cat is on the table and it is happy\n'
+                      'привет мир\n\n', encoding='utf-8')
+    result = app.test_cli_runner().invoke(
+        args=['language', 'benchmark', '--corpus', str(corpus)])
+    assert result.exit_code == 0
+    assert '2 posts, 1 decided by the quick check' in result.output
+    assert 'service (memoized)' in result.output
@@ -0,0 +1,62 @@
+from unittest.mock import MagicMock
+import redis
+from app.metrics import Metrics, RedisMetrics
+
+
+def test_shared_metrics_go_to_the_shared_store():
+    """Test metrics recorded as shared are kept out of the process"""
+    shared = MagicMock()
+    shared.snapshot.return_value = {'jobs.done': 3}
+    metrics = Metrics(shared=shared)
+    metrics.incr('requests')
+    metrics.incr('jobs.done', 2, shared=True)
+    metrics.observe('jobs.seconds', 1.5, shared=True)
+
+    shared.incr.assert_called_once_with('jobs.done', 2)
+    shared.observe.assert_called_once_with('jobs.seconds', 1.5)
+    assert metrics.snapshot() == {'requests': 1, 'jobs.done': 3}
+
+
+def test_shared_metrics_without_a_store():
+    """Test shared metrics stay in process when there is no store"""
+    metrics = Metrics()
+    metrics.incr('jobs.done', 2, shared=True)
+    metrics.observe('jobs.seconds', 1.5, shared=True)
+    assert metrics.snapshot() == {
+        'jobs.done': 2,
+        'jobs.seconds': {'count': 1, 'avg': 1.5, 'max': 1.5}}
+
+
+def test_redis_metrics(app):
+    """Test counters and timings are read back from Redis"""
+    connection = MagicMock()
+    pipeline = connection.pipeline.return_value
+    metrics = RedisMetrics(connection)
+
+    metrics.incr('jobs.done', 2)
+    connection.hincrby.assert_called_once_with('metrics:counters',
+                                               'jobs.done', 2)
+    metrics.observe('jobs.seconds', 1.5)
+    pipeline.zadd.assert_called_once_with('metrics:max',
+                                          {'jobs.seconds': 1.5}, gt=True)
+
+    pipeline.execute.return_value = [
+        {b'jobs.done': b'4'},
+        {b'jobs.seconds:count': b'2', b'jobs.seconds:total': b'4.0'},
+        [(b'jobs.seconds', 3.0)]]
+    assert metrics.snapshot() == {
+        'jobs.done': 4,
+        'jobs.seconds': {'count': 2, 'avg': 2.0, 'max': 3.0}}
+
+
+def test_redis_metrics_failure(app):
+    """Test an unreachable Redis never fails the caller"""
+    connection = MagicMock()
+    connection.hincrby.side_effect = redis.exceptions.ConnectionError()
+    pipeline = connection.pipeline.return_value
+    pipeline.execute.side_effect = redis.exceptions.ConnectionError()
+    metrics = RedisMetrics(connection)
+
+    metrics.incr('jobs.done')
+    metrics.observe('jobs.seconds', 1.5)
+    assert metrics.snapshot() == {}
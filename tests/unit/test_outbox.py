@@ -0,0 +1,177 @@
+import json
+import time
+from unittest.mock import MagicMock
+import flask_mail
+import redis
+from flask_mail import Message
+from app import outbox as outbox_module
+from app.outbox import LocalOutboxQueue, Outbox, RedisOutboxQueue, \
+    dump_message, load_message
+
+
+def make_message(n=0):
+    return Message('Subject {}'.format(n), sender='sender@example.com',
+                   recipients=['user{}@example.com'.format(n)],
+                   body='Body {}'.format(n), html='<p>Body {}</p>'.format(n))
+
+
+def smtp_mail(app, port):
+    # The Mail extension is mocked out for the test suite, so build the
+    # real SMTP state directly
+    state = flask_mail._Mail('127.0.0.1', None, None, port, False, False,
+                             None, 0, None, False)
+    app.extensions['mail'] = state
+    return state
+
+
+def test_message_round_trip():
+    """Test queued messages survive serialization with attachments"""
+    msg = make_message()
+    msg.attach('posts.json', 'application/json', '{"posts": []}')
+    msg.attach('image.png', 'image/png', b'\x89PNG')
+
+    loaded = load_message(json.loads(json.dumps(dump_message(msg))))
+
+    assert loaded.subject == msg.subject
+    assert loaded.recipients == msg.recipients
+    assert loaded.html == msg.html
+    assert [(a.filename, a.data) for a in loaded.attachments] == [
+        ('posts.json', b'{"posts": []}'), ('image.png', b'\x89PNG')]
+
+
+def test_drain_reuses_connection(app, mail_sink):
+    """Test a backlog of messages goes out over one SMTP connection"""
+    outbox = Outbox(app, smtp_mail(app, mail_sink.port), LocalOutboxQueue(),
+                    workers=0, linger=0)
+    for n in range(3):
+        outbox.put(make_message(n))
+    assert app.metrics.snapshot()['email.queue_depth'] == 3
+
+    outbox.drain()
+
+    assert [envelope.rcpt_tos for envelope in mail_sink.messages] == [
+        ['user0@example.com'], ['user1@example.com'], ['user2@example.com']]
+    assert len(mail_sink.connections) == 1
+    metrics = app.metrics.snapshot()
+    assert metrics['email.sent'] == 3
+    assert metrics['email.send_latency']['count'] == 3
+    assert metrics['email.queue_depth'] == 0
+
+
+def test_workers_send_queued_messages(app, mail_sink):
+    """Test the worker pool drains the outbox in the background"""
+    outbox = Outbox(app, smtp_mail(app, mail_sink.port), LocalOutboxQueue(),
+                    workers=2, linger=0.1)
+    for n in range(5):
+        outbox.put(make_message(n))
+
+    deadline = time.monotonic() + 5
+    while len(mail_sink.messages) < 5 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert len(mail_sink.messages) == 5
+    assert len(outbox._threads) == 2
+
+
+def test_failed_sends_are_retried(app):
+    """Test failed messages are requeued until the retries run out"""
+    mail = MagicMock()
+    mail.connect.side_effect = ConnectionRefusedError()
+    outbox = Outbox(app, mail, LocalOutboxQueue(), workers=0, max_retries=1,
+                    backoff=0)
+    outbox.put(make_message())
+
+    outbox.drain()
+    assert len(outbox.queue) == 1
+    assert app.metrics.snapshot()['email.retries'] == 1
+
+    outbox.drain()
+    assert len(outbox.queue) == 0
+    assert app.metrics.snapshot()['email.failed'] == 1
+
+
+def test_unsendable_messages_are_dropped(app):
+    """Test a message failing outside SMTP does not stop the others"""
+    mail = MagicMock()
+    connection = mail.connect.return_value.__enter__.return_value
+    connection.send.side_effect = [ValueError(), None]
+    outbox = Outbox(app, mail, LocalOutboxQueue(), workers=0, linger=0)
+    outbox.put(make_message(0))
+    outbox.put(make_message(1))
+
+    outbox.drain()
+
+    assert connection.send.call_count == 2
+    assert len(outbox.queue) == 0
+    metrics = app.metrics.snapshot()
+    assert metrics['email.failed'] == 1
+    assert metrics['email.sent'] == 1
+
+
+def test_dead_workers_are_replaced(app):
+    """Test workers that exited are replaced on the next put"""
+    outbox = Outbox(app, MagicMock(), LocalOutboxQueue(), workers=1)
+    dead = MagicMock()
+    dead.is_alive.return_value = False
+    outbox._threads = [dead]
+
+    outbox.put(make_message())
+
+    assert dead not in outbox._threads
+    assert len(outbox._threads) == 1
+
+
+def test_redis_outbox_queue_falls_back(app):
+    """Test messages stay in process while Redis cannot be written"""
+    connection = MagicMock()
+    connection.rpush.side_effect = redis.exceptions.ConnectionError()
+    connection.llen.side_effect = redis.exceptions.ConnectionError()
+    outbox_queue = RedisOutboxQueue(connection)
+    item = {'message': dump_message(make_message()), 'queued': 1.0,
+            'attempts': 0}
+
+    outbox_queue.put(item)
+
+    assert len(outbox_queue) == 1
+    assert outbox_queue.get(timeout=0) == item
+    connection.lpop.assert_not_called()
+
+
+def test_local_messages_are_sent_at_exit(app):
+    """Test messages held in process are drained when the process exits"""
+    mail = MagicMock()
+    connection = mail.connect.return_value.__enter__.return_value
+    redis_connection = MagicMock()
+    redis_connection.rpush.side_effect = redis.exceptions.ConnectionError()
+    local = Outbox(app, mail, LocalOutboxQueue(), workers=0)
+    fallback = Outbox(app, mail, RedisOutboxQueue(redis_connection),
+                      workers=0)
+    local.put(make_message(0))
+    fallback.put(make_message(1))
+
+    outbox_module._drain_started_outboxes()
+
+    assert sorted(c.args[0].recipients[0]
+                  for c in connection.send.call_args_list) == [
+        'user0@example.com', 'user1@example.com']
+    # Messages stored in Redis are left for the next worker
+    redis_connection.lpop.assert_not_called()
+    assert len(local.queue) == 0
+
+
+def test_redis_outbox_queue():
+    """Test the Redis queue stores messages as JSON in a list"""
+    connection = MagicMock()
+    outbox_queue = RedisOutboxQueue(connection)
+    item = {'message': dump_message(make_message()), 'queued': 1.0,
+            'attempts': 0}
+
+    outbox_queue.put(item)
+    key, value = connection.rpush.call_args[0]
+    assert key == 'mail:outbox'
+
+    connection.lpop.return_value = value.encode('utf-8')
+    assert outbox_queue.get(timeout=0) == item
+    connection.blpop.return_value = None
+    assert outbox_queue.get(timeout=0.5) is None
+    connection.blpop.assert_called_once_with('mail:outbox', timeout=1)
@@ -0,0 +1,66 @@
+from datetime import datetime, timezone, timedelta
+import pytest
+from app import db
+from app.models import User, Post
+from app.pagination import encode_cursor, decode_cursor, paginate
+
+
+def test_cursor_round_trip():
+    """Test cursors decode back to the (timestamp, id) they encode."""
+    ts = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    cursor = encode_cursor(ts, 42)
+    assert '|' not in cursor
+    assert decode_cursor(cursor) == (ts, 42)
+
+    # Aware timestamps are normalized to naive UTC like the stored values
+    aware = ts.replace(tzinfo=timezone(timedelta(hours=2)))
+    assert decode_cursor(encode_cursor(aware, 42)) == \
+        (ts - timedelta(hours=2), 42)
+
+
+@pytest.mark.parametrize('cursor', [None, '', 'not-a-cursor', '!!!', 'fA'])
+def test_invalid_cursor(cursor):
+    """Test malformed cursors are treated as no cursor."""
+    assert decode_cursor(cursor) is None
+
+
+def test_paginate_forward_and_back(app):
+    """Test walking pages with before/after cursors."""
+    user = User(username='john', email='john@example.com')
+    db.session.add(user)
+    now = datetime.now(timezone.utc)
+    # Two posts share a timestamp so the id tie-breaker is exercised
+    posts = [Post(body=f'post {i}', author=user,
+                  timestamp=now + timedelta(seconds=min(i, 3)))
+             for i in range(5)]
+    db.session.add_all(posts)
+    db.session.commit()
+    newest_first = sorted(posts, key=lambda p: (p.timestamp, p.id),
+                          reverse=True)
+    query = db.select(Post)
+
+    page1 = paginate(query, Post.timestamp, Post.id, 2)
+    assert page1.items == newest_first[:2]
+    assert page1.has_next and not page1.has_prev
+    assert page1.total is None
+
+    page2 = paginate(query, Post.timestamp, Post.id, 2,
+                     before=decode_cursor(page1.next_cursor))
+    assert page2.items == newest_first[2:4]
+    assert page2.has_next and page2.has_prev
+
+    page3 = paginate(query, Post.timestamp, Post.id, 2,
+                     before=decode_cursor(page2.next_cursor), count=True)
+    assert page3.items == newest_first[4:]
+    assert not page3.has_next and page3.has_prev
+    assert page3.total == 5
+
+    back = paginate(query, Post.timestamp, Post.id, 2,
+                    after=decode_cursor(page3.prev_cursor))
+    assert back.items == page2.items
+    assert back.has_next and back.has_prev
+
+    first = paginate(query, Post.timestamp, Post.id, 2,
+                     after=decode_cursor(page2.prev_cursor))
+    assert first.items == page1.items
+    assert not first.has_prev
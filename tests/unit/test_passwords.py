@@ -0,0 +1,77 @@
+import threading
+import pytest
+from app import db
+from app.models import User
+from app.passwords import PasswordHasher, PasswordHasherBusy, \
+    normalize_method
+
+
+def test_normalize_method():
+    """Test Werkzeug defaults are filled in for comparison with hashes."""
+    assert normalize_method('scrypt') == 'scrypt:32768:8:1'
+    assert normalize_method('pbkdf2') == 'pbkdf2:sha256:600000'
+    assert normalize_method('pbkdf2:sha256:1000') == 'pbkdf2:sha256:1000'
+
+
+def test_hash_and_verify():
+    """Test hashes made on the pool verify and record their method."""
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=2)
+    password_hash = hasher.hash('cat')
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert hasher.verify(password_hash, 'cat')
+    assert not hasher.verify(password_hash, 'dog')
+    assert not hasher.verify(None, 'cat')
+    assert not hasher.needs_rehash(password_hash)
+    assert PasswordHasher('pbkdf2:sha256:2000').needs_rehash(password_hash)
+
+
+def test_back_pressure():
+    """Test callers are turned away once the pool and queue are full."""
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, queue_size=0,
+                            timeout=0.01)
+    release = threading.Event()
+    worker = threading.Thread(target=hasher._run, args=(release.wait,))
+    worker.start()
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash('cat')
+    finally:
+        release.set()
+        worker.join()
+    assert hasher.verify(hasher.hash('cat'), 'cat')
+
+
+def test_rehash_on_login(app):
+    """Test a successful login upgrades a hash made with old parameters."""
+    app.passwords = PasswordHasher('pbkdf2:sha256:1000')
+    user = User(username='john', email='john@example.com')
+    user.set_password('cat')
+    db.session.add(user)
+    db.session.commit()
+
+    app.passwords = PasswordHasher('pbkdf2:sha256:2000')
+    assert not user.check_password('dog')
+    assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+    assert user.check_password('cat')
+    assert user.password_hash.startswith('pbkdf2:sha256:2000$')
+    assert user.check_password('cat')
+
+
+def test_busy_api_login(client, test_user, app):
+    """Test the token endpoint answers 503 when hashing is saturated."""
+    app.passwords = PasswordHasher(workers=1, queue_size=0, timeout=0)
+    app.passwords._slots.acquire()
+    response = client.post('/api/tokens',
+                           auth=(test_user.username, 'password'))
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_password_benchmark_command(app):
+    """Test the benchmark reports a rate for the requested method."""
+    result = app.test_cli_runner().invoke(args=[
+        'passwords', 'benchmark', '--logins', '4',
+        '--method', 'pbkdf2:sha256:1000'])
+    assert result.exit_code == 0
+    assert 'pbkdf2:sha256:1000: ' in result.output
+    assert 'logins/sec' in result.output
@@ -0,0 +1,108 @@
+import time
+from datetime import datetime, timezone, timedelta
+from app import db
+from app.models import User
+from app.presence import LastSeenBuffer
+
+
+def test_last_seen_is_buffered(app):
+    """Test last seen times are written in one batch on flush."""
+    old = datetime(2020, 1, 1)
+    u1 = User(username='john', email='john@example.com', last_seen=old)
+    u2 = User(username='susan', email='susan@example.com', last_seen=old)
+    db.session.add_all([u1, u2])
+    db.session.commit()
+    buffer = LastSeenBuffer(User, granularity=60, flush_interval=3600)
+
+    now = datetime.now(timezone.utc)
+    buffer.touch(u1, now)
+    buffer.touch(u2, now)
+    db.session.expire_all()
+    assert u1.last_seen == old
+
+    buffer.flush()
+    db.session.expire_all()
+    assert u1.last_seen == now.replace(tzinfo=None)
+    assert u2.last_seen == now.replace(tzinfo=None)
+
+
+def test_last_seen_granularity(app, count_queries):
+    """Test recently seen users are not written again."""
+    now = datetime.now(timezone.utc)
+    u = User(username='john', email='john@example.com',
+             last_seen=now - timedelta(seconds=30))
+    db.session.add(u)
+    db.session.commit()
+    buffer = LastSeenBuffer(User, granularity=60, flush_interval=3600)
+
+    buffer.touch(u, now)
+    with count_queries() as statements:
+        buffer.flush()
+    assert statements == []
+
+    # Once stale, only the first touch is recorded until the next flush
+    buffer.touch(u, now + timedelta(seconds=40))
+    buffer.touch(u, now + timedelta(seconds=50))
+    buffer.flush()
+    db.session.expire_all()
+    assert u.last_seen == (now + timedelta(seconds=40)).replace(tzinfo=None)
+
+
+def test_last_seen_flush_interval(app):
+    """Test touches flush the buffer once the interval has elapsed."""
+    u = User(username='john', email='john@example.com',
+             last_seen=datetime(2020, 1, 1))
+    db.session.add(u)
+    db.session.commit()
+    buffer = LastSeenBuffer(User, granularity=60, flush_interval=0)
+
+    now = datetime.now(timezone.utc)
+    buffer.touch(u, now)
+    db.session.expire_all()
+    assert u.last_seen == now.replace(tzinfo=None)
+
+
+def test_last_seen_ignores_stale_user_copies(app, count_queries):
+    """Test a cached user object does not requeue a user after a flush."""
+    old = datetime(2020, 1, 1)
+    u = User(username='john', email='john@example.com', last_seen=old)
+    db.session.add(u)
+    db.session.commit()
+    cached = User(id=u.id, last_seen=old)  # never refreshed from the row
+    buffer = LastSeenBuffer(User, granularity=60, flush_interval=0)
+
+    now = datetime.now(timezone.utc)
+    with count_queries() as statements:
+        for seconds in range(0, 60, 10):
+            buffer.touch(cached, now + timedelta(seconds=seconds))
+    assert len([s for s in statements if s.startswith('UPDATE')]) == 1
+
+
+def test_last_seen_flushed_without_requests(app):
+    """Test pending times reach the database on a timer and at exit."""
+    from app import presence
+    u = User(username='john', email='john@example.com',
+             last_seen=datetime(2020, 1, 1))
+    db.session.add(u)
+    db.session.commit()
+    buffer = LastSeenBuffer(User, granularity=60, flush_interval=0.1)
+    buffer._last_flush = time.monotonic() + 3600  # not due on touch
+
+    now = datetime.now(timezone.utc)
+    buffer.touch(u, now)
+    buffer._last_flush = time.monotonic()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        db.session.expire_all()
+        if u.last_seen == now.replace(tzinfo=None):
+            break
+        time.sleep(0.05)
+    assert u.last_seen == now.replace(tzinfo=None)
+
+    # Whatever is still pending when the process exits is written too
+    buffer.flush_interval = 3600
+    later = now + timedelta(minutes=5)
+    buffer.touch(u, later)
+    presence._flush_started_buffers()
+    db.session.expire_all()
+    assert u.last_seen == later.replace(tzinfo=None)
@@ -0,0 +1,40 @@
+from unittest.mock import MagicMock, patch
+from app.progress import LocalTaskProgress, RedisTaskProgress
+
+
+def test_local_task_progress():
+    """Test the in-process store reports unknown tasks as not started"""
+    store = LocalTaskProgress()
+    assert store.set('a', 10) is None
+    assert store.set('a', 20) == 10
+    assert store.get_many(['a', 'b']) == {'a': 20, 'b': 0}
+
+
+def test_redis_task_progress_set():
+    """Test progress is written to a hash with an expiry"""
+    connection = MagicMock()
+    pipeline = connection.pipeline.return_value
+    pipeline.execute.return_value = [b'40', 1, True]
+    store = RedisTaskProgress(connection, ttl=60)
+
+    assert store.set('a', 50) == 40
+    pipeline.hget.assert_called_once_with('task-progress:a', 'progress')
+    assert pipeline.hset.call_args[1]['mapping']['progress'] == 50
+    pipeline.expire.assert_called_once_with('task-progress:a', 60)
+
+
+@patch('app.progress.rq.job.Job.fetch_many')
+def test_redis_task_progress_get_many(mock_fetch_many, app):
+    """Test one pipeline reads every task and jobs are fetched in bulk"""
+    connection = MagicMock()
+    connection.pipeline.return_value.execute.return_value = [b'30', None,
+                                                             None]
+    queued = MagicMock()
+    queued.meta = {}
+    mock_fetch_many.return_value = [queued, None]
+    store = RedisTaskProgress(connection)
+
+    assert store.get_many(['a', 'b', 'c']) == {'a': 30, 'b': 0, 'c': 100}
+    connection.pipeline.assert_called_once()
+    mock_fetch_many.assert_called_once_with(['b', 'c'],
+                                            connection=connection)
@@ -0,0 +1,66 @@
+import json
+from unittest.mock import MagicMock
+from app import db
+from app.models import User, Notification
+from app.pubsub import LocalBroker, RedisBroker
+
+
+def test_local_broker():
+    """Test messages reach every subscriber of a channel."""
+    broker = LocalBroker()
+    s1 = broker.subscribe('a')
+    s2 = broker.subscribe('a')
+    other = broker.subscribe('b')
+    broker.publish('a', 'hello')
+    assert s1.get(0) == 'hello'
+    assert s2.get(0) == 'hello'
+    assert other.get(0) is None
+
+    # Closed subscriptions stop receiving messages
+    s1.close()
+    s2.close()
+    broker.publish('a', 'again')
+    assert s1.get(0) is None
+    assert 'a' not in broker._subscribers
+    other.close()
+
+
+def test_redis_broker(app):
+    """Test the Redis broker maps onto Redis pub/sub."""
+    connection = MagicMock()
+    pubsub = connection.pubsub.return_value
+    pubsub.get_message.return_value = {'type': 'message', 'data': b'hello'}
+    broker = RedisBroker(connection)
+
+    broker.publish('a', 'hello')
+    connection.publish.assert_called_once_with('a', 'hello')
+    subscription = broker.subscribe('a')
+    pubsub.subscribe.assert_called_once_with('a')
+    assert subscription.get(1) == 'hello'
+    pubsub.get_message.return_value = None
+    assert subscription.get(1) is None
+    subscription.close()
+    pubsub.close.assert_called_once()
+
+
+def test_notifications_published_on_commit(app):
+    """Test notifications are published only once committed."""
+    u = User(username='john', email='john@example.com')
+    db.session.add(u)
+    db.session.commit()
+    subscription = app.broker.subscribe(Notification.channel(u.id))
+
+    u.add_notification('unread_message_count', 1)
+    assert subscription.get(0) is None
+    db.session.commit()
+    event = subscription.get(0)
+    assert event.startswith('id: ')
+    payload = json.loads(event.split('data: ')[1])
+    assert payload['name'] == 'unread_message_count'
+    assert payload['data'] == 1
+
+    u.add_notification('unread_message_count', 2)
+    db.session.rollback()
+    db.session.commit()
+    assert subscription.get(0) is None
+    subscription.close()
@@ -1,7 +1,10 @@
 import unittest
 from unittest.mock import patch, MagicMock
 from flask import Flask
-from app.search import add_to_index, remove_from_index, query_index
+from elastic_transport import ConnectionError as ESConnectionError
+from app.metrics import Metrics
+from app.search import add_to_index, remove_from_index, query_index, \
+    IndexingQueue, rebuild_index, swap_alias
 
 
 class MockModel:
@@ -146,5 +149,196 @@ class SearchTestCase(unittest.TestCase):
         self.assertEqual(total, 0)
 
 
+class IndexingQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.elasticsearch = MagicMock()
+        self.app.elasticsearch.bulk.return_value = {'errors': False,
+                                                    'items': []}
+        self.app.elasticsearch.indices.exists_alias.return_value = False
+        self.app.metrics = Metrics()
+        # A long interval keeps the worker thread from flushing on its own
+        self.queue = IndexingQueue(self.app, batch_size=100,
+                                   flush_interval=3600, backoff=0)
+
+    def tearDown(self):
+        # Nothing is left for the flush at interpreter exit
+        with self.queue._cond:
+            self.queue._pending.clear()
+
+    def test_changes_are_coalesced(self):
+        """Test only the latest change per document is sent in one batch"""
+        self.queue.put('post', 1, {'body': 'first'})
+        self.queue.put('post', 2, {'body': 'other'})
+        self.queue.put('post', 1, {'body': 'second'})
+        self.queue.put('post', 2, None)
+        self.assertGreater(self.queue.lag(), 0)
+
+        self.queue.flush()
+        self.app.elasticsearch.bulk.assert_called_once_with(operations=[
+            {'index': {'_index': 'post', '_id': 1}}, {'body': 'second'},
+            {'delete': {'_index': 'post', '_id': 2}},
+        ])
+        self.assertEqual(self.queue.lag(), 0.0)
+        self.assertEqual(
+            self.app.metrics.snapshot()['search.documents_indexed'], 2)
+
+    def test_batches_are_bounded(self):
+        """Test a flush splits pending changes into batch_size requests"""
+        self.queue.batch_size = 2
+        for id in range(5):
+            self.queue.put('post', id, {'body': str(id)})
+        self.queue.flush()
+        self.assertEqual(self.app.elasticsearch.bulk.call_count, 3)
+
+    @patch('app.search.time.sleep')
+    def test_retry_with_backoff(self, mock_sleep):
+        """Test failed bulk requests are retried with growing delays"""
+        self.queue.backoff = 0.5
+        self.app.elasticsearch.bulk.side_effect = [
+            ESConnectionError('down'), ESConnectionError('down'),
+            {'errors': False, 'items': []}]
+        self.queue.put('post', 1, {'body': 'text'})
+        self.queue.flush()
+        self.assertEqual(self.app.elasticsearch.bulk.call_count, 3)
+        mock_sleep.assert_has_calls([unittest.mock.call(0.5),
+                                     unittest.mock.call(1.0)])
+        self.assertEqual(self.app.metrics.snapshot()['search.bulk_errors'], 2)
+
+    def test_gives_up_and_keeps_changes(self):
+        """Test changes stay queued once retries are exhausted"""
+        self.queue.max_retries = 1
+        self.app.elasticsearch.bulk.side_effect = ESConnectionError('down')
+        self.queue.put('post', 1, {'body': 'text'})
+        self.queue.flush()
+        self.assertEqual(self.app.elasticsearch.bulk.call_count, 2)
+        self.assertIn(('post', 1), self.queue._pending)
+
+    @patch('app.search.time.sleep')
+    def test_flush_without_retries(self, mock_sleep):
+        """Test a flush can be limited to a single attempt"""
+        self.app.elasticsearch.bulk.side_effect = ESConnectionError('down')
+        self.queue.put('post', 1, {'body': 'text'})
+        self.queue.flush(max_retries=0)
+        self.assertEqual(self.app.elasticsearch.bulk.call_count, 1)
+        mock_sleep.assert_not_called()
+        self.assertIn(('post', 1), self.queue._pending)
+
+    def test_throttled_items_are_requeued(self):
+        """Test items rejected with a retryable status are queued again"""
+        self.app.elasticsearch.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_index': 'post', '_id': '1', 'status': 429}},
+            {'index': {'_index': 'post', '_id': '2', 'status': 201}},
+            {'delete': {'_index': 'post', '_id': '3', 'status': 404}},
+        ]}
+        self.queue.put('post', 1, {'body': 'one'})
+        self.queue.put('post', 2, {'body': 'two'})
+        self.queue.put('post', 3, None)
+        self.queue._send(self.queue._take())
+        self.assertEqual(list(self.queue._pending), [('post', 1)])
+
+    def test_changes_reach_the_index_being_rebuilt(self):
+        """Test changes are written to the rebuild alias as well"""
+        self.app.elasticsearch.indices.exists_alias.return_value = True
+        self.app.elasticsearch.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_index': 'post-old', '_id': '1', 'status': 200}},
+            {'index': {'_index': 'post-new', '_id': '1', 'status': 429}},
+        ]}
+        self.queue.put('post', 1, {'body': 'one'})
+        self.queue._send(self.queue._take())
+        self.app.elasticsearch.bulk.assert_called_once_with(operations=[
+            {'index': {'_index': 'post', '_id': 1}}, {'body': 'one'},
+            {'index': {'_index': 'post-rebuild', '_id': 1}}, {'body': 'one'},
+        ])
+        self.app.elasticsearch.indices.exists_alias.assert_called_once_with(
+            name='post-rebuild')
+        # A failure in either index queues the change again
+        self.assertEqual(list(self.queue._pending), [('post', 1)])
+
+
+class RebuildIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.elasticsearch = MagicMock()
+        self.app.elasticsearch.bulk.return_value = {'errors': False,
+                                                    'items': []}
+        self.app.elasticsearch.indices.exists.return_value = False
+        self.app.elasticsearch.indices.exists_alias.side_effect = \
+            lambda name, index=None: name == 'post' or index is not None
+        self.app.elasticsearch.indices.get_alias.return_value = {
+            'post-old': {'aliases': {'post': {}}}}
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_rebuild_index(self):
+        """Test chunks are bulk indexed into a new index that is swapped in"""
+        chunks = [(2, [(1, {'body': 'a'}), (2, {'body': 'b'})]),
+                  (5, [(5, {'body': 'c'})])]
+        progress = MagicMock()
+        index = rebuild_index('post', iter(chunks), workers=2,
+                              progress=progress, settle=0)
+
+        es = self.app.elasticsearch
+        self.assertTrue(index.startswith('post-'))
+        es.indices.create.assert_called_once_with(
+            index=index, settings={'refresh_interval': '-1'})
+        self.assertEqual(es.bulk.call_count, 2)
+        es.bulk.assert_any_call(operations=[
+            {'create': {'_index': index, '_id': 5}}, {'body': 'c'}])
+        # Progress is reported in id order with a running total
+        progress.assert_has_calls([unittest.mock.call(index, 2, 2),
+                                   unittest.mock.call(index, 5, 3)])
+        # Writers are pointed at the new index before it is filled, and the
+        # old index is only deleted after the alias has moved
+        self.assertEqual(es.indices.update_aliases.call_args_list, [
+            unittest.mock.call(actions=[
+                {'add': {'index': index, 'alias': 'post-rebuild'}}]),
+            unittest.mock.call(actions=[
+                {'remove': {'index': 'post-old', 'alias': 'post'}},
+                {'add': {'index': index, 'alias': 'post'}},
+                {'remove': {'index': index, 'alias': 'post-rebuild'}}]),
+        ])
+        es.indices.delete.assert_called_once_with(index='post-old')
+
+    def test_rebuild_keeps_newer_documents(self):
+        """Test documents already written by the queue are not replaced"""
+        self.app.elasticsearch.bulk.return_value = {'errors': True, 'items': [
+            {'create': {'_id': '1', 'status': 409}}]}
+        rebuild_index('post', iter([(1, [(1, {'body': 'a'})])]), settle=0)
+        self.app.elasticsearch.indices.update_aliases.assert_called()
+
+    def test_rebuild_index_resume(self):
+        """Test resuming into an existing index does not recreate it"""
+        self.app.elasticsearch.indices.exists.return_value = True
+        index = rebuild_index('post', iter([]), index='post-partial',
+                              settle=0)
+        self.assertEqual(index, 'post-partial')
+        self.app.elasticsearch.indices.create.assert_not_called()
+
+    def test_rebuild_index_failure(self):
+        """Test failed documents abort the rebuild before the alias swap"""
+        self.app.elasticsearch.bulk.return_value = {'errors': True, 'items': [
+            {'create': {'_id': '1', 'status': 400, 'error': 'bad'}}]}
+        with self.assertRaises(RuntimeError):
+            rebuild_index('post', iter([(1, [(1, {'body': 'a'})])]),
+                          settle=0)
+        # Only the rebuild alias was added, the served alias never moved
+        self.app.elasticsearch.indices.update_aliases.assert_called_once()
+        self.app.elasticsearch.indices.delete.assert_not_called()
+
+    def test_swap_alias_replaces_concrete_index(self):
+        """Test a plain index with the alias name is removed on swap"""
+        self.app.elasticsearch.indices.exists_alias.side_effect = None
+        self.app.elasticsearch.indices.exists_alias.return_value = False
+        self.app.elasticsearch.indices.exists.return_value = True
+        swap_alias('post', 'post-new')
+        self.app.elasticsearch.indices.update_aliases.assert_called_once_with(
+            actions=[{'remove_index': {'index': 'post'}},
+                     {'add': {'index': 'post-new', 'alias': 'post'}}])
+
+
 if __name__ == '__main__':
     unittest.main()
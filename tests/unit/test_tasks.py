@@ -1,11 +1,16 @@
+import gzip
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock, call
 import json
 from datetime import datetime, timezone
 from flask import current_app
 from app import create_app, db
-from app.models import User, Post, Task
-from app.tasks import _set_task_progress, export_posts
+from app.models import User, Post, Notification, Task
+from app import tasks
+from app.progress import LocalTaskProgress
+from app.tasks import _set_task_progress, export_posts, pretranslate_posts
 from config import Config
 
 
@@ -41,6 +46,7 @@ class TasksTestCase(unittest.TestCase):
         db.drop_all()
         self.app_context.pop()
 
+    @patch.object(tasks.app, 'task_progress', LocalTaskProgress())
     @patch('app.tasks.get_current_job')
     def test_set_task_progress(self, mock_get_job):
         """Test setting task progress"""
@@ -56,15 +62,28 @@ class TasksTestCase(unittest.TestCase):
         db.session.commit()
         
         # Call the function
-        _set_task_progress(50)
+        _set_task_progress(0)
         
         # Assertions
-        mock_job.save_meta.assert_called_once()
-        self.assertEqual(mock_job.meta['progress'], 50)
+        mock_job.save_meta.assert_not_called()
+        self.assertEqual(tasks.app.task_progress.get_many(['test_job_id']),
+                         {'test_job_id': 0})
         
         # Check the task is updated in the database
         task = db.session.get(Task, 'test_job_id')
         self.assertEqual(task.complete, False)
+        self.assertEqual(len(db.session.scalars(self.user.notifications.select()).all()), 1)
+
+        # Progress ticks are published without touching the database
+        with patch.object(tasks.app, 'broker') as mock_broker, \
+                patch.object(db.session, 'commit') as mock_commit:
+            _set_task_progress(50)
+        mock_commit.assert_not_called()
+        channel, event = mock_broker.publish.call_args[0]
+        self.assertEqual(channel, Notification.channel(self.user.id))
+        self.assertIn('"progress": 50', event)
+        self.assertEqual(tasks.app.task_progress.get_many(['test_job_id']),
+                         {'test_job_id': 50})
         
         # Test completion (100%)
         _set_task_progress(100)
@@ -74,16 +93,20 @@ class TasksTestCase(unittest.TestCase):
     @patch('app.tasks.send_email')
     @patch('app.tasks._set_task_progress')
     @patch('app.tasks.get_current_job')
-    @patch('time.sleep')  # Mock sleep to speed up test
-    def test_export_posts(self, mock_sleep, mock_get_job, mock_set_progress, mock_send_email):
+    def test_export_posts(self, mock_get_job, mock_set_progress, mock_send_email):
         """Test export posts functionality"""
-        # Use the actual admin email from the config
-        # Call the function
-        export_posts(self.user.id)
-        
+        mock_get_job.return_value = None
+        with tempfile.TemporaryDirectory() as export_dir, \
+                patch.dict(tasks.app.config, {'EXPORT_DIR': export_dir}):
+            # Call the function
+            export_posts(self.user.id)
+
+            # Small exports are attached, so no file is left behind
+            self.assertEqual(os.listdir(export_dir), [])
+
         # Check progress was set
-        # Initial, progress updates for 2 posts, and final 100%
-        expected_calls = [call(0), call(50), call(100), call(100)]
+        # Initial, throttled progress for the only chunk, and final 100%
+        expected_calls = [call(0), call(100), call(100)]
         mock_set_progress.assert_has_calls(expected_calls)
         
         # Check email was sent
@@ -110,6 +133,32 @@ class TasksTestCase(unittest.TestCase):
         self.assertEqual(posts[0]['body'], 'Test post 1')
         self.assertEqual(posts[1]['body'], 'Test post 2')
 
+    @patch('app.tasks.send_email')
+    @patch('app.tasks._set_task_progress')
+    @patch('app.tasks.get_current_job')
+    def test_export_posts_download_link(self, mock_get_job, mock_set_progress,
+                                        mock_send_email):
+        """Test large exports are kept on disk and sent as a link"""
+        mock_get_job.return_value.get_id.return_value = 'job-id'
+        with tempfile.TemporaryDirectory() as export_dir, \
+                patch.dict(tasks.app.config, {
+                    'EXPORT_DIR': export_dir, 'EXPORT_FORMAT': 'ndjson',
+                    'EXPORT_COMPRESS': True,
+                    'EXPORT_ATTACHMENT_MAX_SIZE': 0}):
+            export_posts(self.user.id, 'https://microblog.example.com/')
+
+            self.assertEqual(os.listdir(export_dir), ['job-id.ndjson.gz'])
+            with gzip.open(os.path.join(export_dir, 'job-id.ndjson.gz'),
+                           'rt') as f:
+                posts = [json.loads(line) for line in f]
+        self.assertEqual([post['body'] for post in posts],
+                         ['Test post 1', 'Test post 2'])
+
+        call_args = mock_send_email.call_args
+        self.assertIsNone(call_args[1]['attachments'])
+        self.assertIn('https://microblog.example.com/exports/job-id.ndjson.gz',
+                      call_args[1]['text_body'])
+
     @patch('app.tasks.send_email')
     @patch('app.tasks._set_task_progress')
     def test_export_posts_exception_handling(self, mock_set_progress, mock_send_email):
@@ -118,11 +167,28 @@ class TasksTestCase(unittest.TestCase):
         mock_send_email.side_effect = Exception("Test exception")
         
         # Call function
-        export_posts(self.user.id)
+        with tempfile.TemporaryDirectory() as export_dir, \
+                patch.dict(tasks.app.config, {'EXPORT_DIR': export_dir}):
+            export_posts(self.user.id)
         
         # Should still set final progress to 100%
         mock_set_progress.assert_called_with(100)
 
 
+    @patch('app.tasks.get_current_job')
+    @patch('app.tasks.prefetch_translations')
+    def test_pretranslate_posts(self, mock_prefetch, mock_get_job):
+        """Test the pre-translation job records its throughput"""
+        stats = {'translations': 4, 'seconds': 2.0, 'per_second': 2.0}
+        mock_prefetch.return_value = stats
+        mock_job = MagicMock()
+        mock_job.meta = {}
+        mock_get_job.return_value = mock_job
+
+        pretranslate_posts()
+        self.assertEqual(mock_job.meta, stats)
+        mock_job.save_meta.assert_called_once()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,11 @@
+import hashlib
 import unittest
+import requests
 from unittest.mock import patch, MagicMock
 from flask import Flask
 from flask_babel import Babel
-from app.translate import translate
+from app.translate import translate, translate_many, \
+    LocalTranslationCache, RedisTranslationCache
 from config import Config
 
 
@@ -16,6 +19,7 @@ class TranslateTestCase(unittest.TestCase):
         self.app = Flask(__name__)
         self.app.config.from_object(TestConfig)
         self.babel = Babel(self.app)
+        self.app.translation_cache = LocalTranslationCache()
         self.app_context = self.app.app_context()
         self.app_context.push()
 
@@ -28,7 +32,7 @@ class TranslateTestCase(unittest.TestCase):
         result = translate('Hello', 'en', 'es')
         self.assertIn('Error: the translation service is not configured', result)
 
-    @patch('app.translate.requests.post')
+    @patch('app.translate.session.post')
     def test_translate_error_status_code(self, mock_post):
         """Test handling of non-200 status code from translation API"""
         mock_response = MagicMock()
@@ -44,7 +48,7 @@ class TranslateTestCase(unittest.TestCase):
         self.assertIn('translate?api-version=3.0&from=en&to=es', args[0])
         self.assertEqual(kwargs['headers']['Ocp-Apim-Subscription-Key'], 'test_key')
 
-    @patch('app.translate.requests.post')
+    @patch('app.translate.session.post')
     def test_translate_success(self, mock_post):
         """Test successful translation"""
         # Mock a successful API response
@@ -70,5 +74,72 @@ class TranslateTestCase(unittest.TestCase):
         self.assertEqual(kwargs['headers']['Ocp-Apim-Subscription-Region'], 'westus')
 
 
+    @patch('app.translate.session.post')
+    def test_translation_is_cached(self, mock_post):
+        """Test a text is only sent upstream once per language pair"""
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = [{
+            'translations': [{'text': 'Hola'}]
+        }]
+        mock_post.return_value = mock_response
+
+        self.assertEqual(translate('Hello', 'en', 'es'), 'Hola')
+        self.assertEqual(translate('Hello', 'en', 'es'), 'Hola')
+        mock_post.assert_called_once()
+        self.assertEqual(mock_post.call_args.kwargs['timeout'],
+                         self.app.config['TRANSLATOR_TIMEOUT'])
+
+    @patch('app.translate.session.post')
+    def test_translate_many(self, mock_post):
+        """Test cache misses are sent in one upstream request"""
+        translate('Hello', 'en', 'es')  # fails, so nothing is cached
+        mock_post.reset_mock()
+        self.app.translation_cache.set_many({
+            'translation:en:es:' + hashlib.sha256(b'Hello').hexdigest():
+                'Hola'})
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = [
+            {'translations': [{'text': 'Adios'}]},
+            {'translations': [{'text': 'Gracias'}]},
+        ]
+        mock_post.return_value = mock_response
+
+        result = translate_many(['Hello', 'Goodbye', 'Thanks', 'Goodbye'],
+                                'en', 'es')
+        self.assertEqual(result, ['Hola', 'Adios', 'Gracias', 'Adios'])
+        mock_post.assert_called_once()
+        self.assertEqual(mock_post.call_args.kwargs['json'],
+                         [{'Text': 'Goodbye'}, {'Text': 'Thanks'}])
+
+    @patch('app.translate.session.post')
+    def test_translate_timeout(self, mock_post):
+        """Test a slow translator is reported as a failed translation"""
+        mock_post.side_effect = requests.Timeout()
+        result = translate('Hello', 'en', 'es')
+        self.assertIn('Error: the translation service failed', result)
+
+    def test_stub_translator(self):
+        """Test the stub translator works without an API key"""
+        self.app.config['TRANSLATOR'] = 'stub'
+        self.app.config['MS_TRANSLATOR_KEY'] = None
+        self.assertEqual(translate_many(['Hello', 'Bye'], 'en', 'es'),
+                         ['[es] Hello', '[es] Bye'])
+
+
+    def test_redis_translation_cache(self):
+        """Test the Redis cache refreshes expiry on reads"""
+        connection = MagicMock()
+        pipeline = connection.pipeline.return_value
+        pipeline.execute.return_value = [b'Hola', None]
+        cache = RedisTranslationCache(connection, ttl=60)
+
+        self.assertEqual(cache.get_many(['a', 'b']), {'a': 'Hola'})
+        pipeline.getex.assert_any_call('a', ex=60)
+        cache.set_many({'b': 'Adios'})
+        pipeline.set.assert_called_once_with('b', 'Adios', ex=60)
+
+
 if __name__ == '__main__':
     unittest.main()
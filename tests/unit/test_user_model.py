@@ -1,7 +1,7 @@
 import unittest
 from datetime import datetime, timezone, timedelta
 from app import db
-from app.models import User, Post
+from app.models import User, Post, Notification
 import pytest
 
 
@@ -102,3 +102,166 @@ def test_user_token(app):
     u.revoke_token()
     db.session.commit()
     assert User.check_token(token) is None
+
+
+def test_timeline_fan_out(app):
+    """Test new posts are pushed to followers' timelines."""
+    u1 = User(username='john', email='john@example.com')
+    u2 = User(username='susan', email='susan@example.com')
+    u3 = User(username='mary', email='mary@example.com')
+    db.session.add_all([u1, u2, u3])
+    db.session.commit()
+    u1.follow(u2)
+    db.session.commit()
+
+    # A post written after the follow is pushed to the follower
+    p1 = Post(body="post from susan", author=u2)
+    p2 = Post(body="post from mary", author=u3)
+    db.session.add_all([p1, p2])
+    db.session.commit()
+    assert db.session.scalars(u1.following_posts()).all() == [p1]
+    assert db.session.scalars(u2.following_posts()).all() == [p1]
+    assert db.session.scalars(u3.following_posts()).all() == [p2]
+
+    # Following backfills the timeline, unfollowing prunes it
+    u1.follow(u3)
+    db.session.commit()
+    assert set(db.session.scalars(u1.following_posts())) == {p1, p2}
+    u1.unfollow(u2)
+    db.session.commit()
+    assert db.session.scalars(u1.following_posts()).all() == [p2]
+
+    # Deleted posts are removed from every timeline
+    db.session.delete(p2)
+    db.session.commit()
+    assert db.session.scalars(u1.following_posts()).all() == []
+    assert db.session.scalars(u3.following_posts()).all() == []
+
+
+def test_hybrid_timeline(app):
+    """Test posts from high-follower authors are pulled at read time."""
+    app.config['TIMELINE_PULL_THRESHOLD'] = 1
+    u1 = User(username='john', email='john@example.com')
+    u2 = User(username='susan', email='susan@example.com')
+    u3 = User(username='mary', email='mary@example.com')
+    u4 = User(username='david', email='david@example.com')
+    db.session.add_all([u1, u2, u3, u4])
+    db.session.commit()
+    u1.follow(u2)
+    u3.follow(u2)  # susan now has more followers than the threshold
+    u1.follow(u4)
+    db.session.commit()
+
+    now = datetime.now(timezone.utc)
+    p1 = Post(body="post from john", author=u1, timestamp=now + timedelta(seconds=1))
+    p2 = Post(body="post from susan", author=u2, timestamp=now + timedelta(seconds=4))
+    p3 = Post(body="post from david", author=u4, timestamp=now + timedelta(seconds=3))
+    p4 = Post(body="old post from susan", author=u2, timestamp=now)
+    db.session.add_all([p1, p2, p3, p4])
+    db.session.commit()
+
+    # Susan's posts are not pushed, only merged in when reading
+    assert db.session.scalars(u1.following_posts()).all() == [p3, p1]
+    assert u1.pulled_authors() == [u2.id]
+    assert u1.home_timeline(10) == [p2, p3, p1, p4]
+    assert u1.home_timeline(2) == [p2, p3]
+
+    # Sources beyond the per-read limit are folded into a single query
+    app.config['TIMELINE_PULL_MAX_SOURCES'] = 0
+    assert u1.home_timeline(10) == [p2, p3, p1, p4]
+
+
+def test_timeline_author_drops_below_threshold(app):
+    """Test posts written while an author was pulled stay in timelines."""
+    app.config['TIMELINE_PULL_THRESHOLD'] = 1
+    u1 = User(username='john', email='john@example.com')
+    u2 = User(username='susan', email='susan@example.com')
+    u3 = User(username='mary', email='mary@example.com')
+    db.session.add_all([u1, u2, u3])
+    db.session.commit()
+    u1.follow(u2)
+    db.session.commit()
+
+    now = datetime.now(timezone.utc)
+    p1 = Post(body="pushed post from susan", author=u2, timestamp=now)
+    db.session.add(p1)
+    db.session.commit()
+    u3.follow(u2)  # susan is pulled from now on
+    db.session.commit()
+    p2 = Post(body="pulled post from susan", author=u2,
+              timestamp=now + timedelta(seconds=1))
+    db.session.add(p2)
+    db.session.commit()
+    assert db.session.scalars(u1.following_posts()).all() == [p1]
+
+    u3.unfollow(u2)
+    db.session.commit()
+    assert u1.pulled_authors() == []
+    assert db.session.scalars(u1.following_posts()).all() == [p2, p1]
+    assert u1.home_timeline(10) == [p2, p1]
+
+
+def test_counters(app):
+    """Test denormalized counters follow posts and follows."""
+    u1 = User(username='john', email='john@example.com')
+    u2 = User(username='susan', email='susan@example.com')
+    u3 = User(username='mary', email='mary@example.com')
+    db.session.add_all([u1, u2, u3])
+    db.session.commit()
+    assert (u1.post_count, u1.follower_count, u1.followed_count) == (0, 0, 0)
+
+    # Following two users before committing counts both follows
+    u1.follow(u2)
+    u1.follow(u3)
+    u2.follow(u3)
+    p1 = Post(body="post from john", author=u1)
+    p2 = Post(body="another post from john", author=u1)
+    db.session.add_all([p1, p2])
+    db.session.commit()
+    assert u1.followed_count == 2
+    assert u3.follower_count == 2
+    assert u1.post_count == 2
+
+    db.session.delete(p1)
+    u1.unfollow(u3)
+    db.session.commit()
+    assert u1.post_count == 1
+    assert u1.followed_count == 1
+    assert u3.follower_count == 1
+    assert u1.to_dict()['post_count'] == 1
+    assert u1.to_dict()['following_count'] == 1
+    assert u3.to_dict()['follower_count'] == 1
+
+
+def test_notification_upsert(app):
+    """Test notifications are replaced in place per user and name."""
+    u = User(username='john', email='john@example.com')
+    db.session.add(u)
+    db.session.commit()
+
+    u.add_notification('unread_message_count', 1)
+    u.add_notification('unread_message_count', 2)
+    u.add_notification('task_progress', {'task_id': 'a', 'progress': 5})
+    db.session.commit()
+
+    notifications = {n.name: n for n in db.session.scalars(
+        u.notifications.select())}
+    assert len(notifications) == 2
+    assert notifications['unread_message_count'].get_data() == 2
+    assert notifications['task_progress'].get_data() == \
+        {'task_id': 'a', 'progress': 5}
+
+
+def test_notification_sweep(app):
+    """Test notifications past their TTL are deleted in batches."""
+    u = User(username='john', email='john@example.com')
+    db.session.add(u)
+    db.session.commit()
+    for i in range(5):
+        Notification.upsert(u.id, 'old{}'.format(i), '0', 0.0)
+    u.add_notification('recent', 0)
+    db.session.commit()
+
+    assert Notification.sweep(max_age=3600, batch_size=2) == 5
+    assert [n.name for n in db.session.scalars(u.notifications.select())] \
+        == ['recent']
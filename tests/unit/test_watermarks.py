@@ -0,0 +1,45 @@
+from unittest.mock import MagicMock
+import redis
+from app.watermarks import LocalWatermarks, RedisWatermarks
+
+
+def test_local_watermarks():
+    """Test marks only move forward and seeding never overwrites"""
+    marks = LocalWatermarks()
+    assert marks.get(1) is None
+    marks.seed(1, 5.0)
+    marks.seed(1, 2.0)
+    assert marks.get(1) == 5.0
+    marks.advance(1, 3.0)
+    assert marks.get(1) == 5.0
+    marks.advance(1, 7.0)
+    assert marks.get(1) == 7.0
+
+
+def test_redis_watermarks(app):
+    """Test marks are kept in one sorted set with GT and NX updates"""
+    connection = MagicMock()
+    marks = RedisWatermarks(connection)
+    connection.zscore.return_value = None
+    assert marks.get(1) is None
+    connection.zscore.return_value = 5.0
+    assert marks.get(1) == 5.0
+
+    marks.advance(1, 7.0)
+    connection.zadd.assert_called_with('notification-marks', {1: 7.0},
+                                       gt=True)
+    marks.seed(1, 2.0)
+    connection.zadd.assert_called_with('notification-marks', {1: 2.0},
+                                       nx=True)
+
+
+def test_redis_watermarks_failure(app):
+    """Test a mark that cannot be advanced is dropped"""
+    connection = MagicMock()
+    connection.zadd.side_effect = redis.exceptions.ConnectionError()
+    connection.zscore.side_effect = redis.exceptions.ConnectionError()
+    marks = RedisWatermarks(connection)
+
+    marks.advance(1, 7.0)
+    connection.zrem.assert_called_once_with('notification-marks', 1)
+    assert marks.get(1) is None